@@ -0,0 +1,41 @@
+"""Add product/cache lookup indexes
+
+Revision ID: 3c9e1f2a7b4d
+Revises: 15afad0d971b
+Create Date: 2026-10-14 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e1f2a7b4d'
+down_revision: Union[str, Sequence[str], None] = '15afad0d971b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_product_inputs_job_ean',
+        'product_inputs',
+        ['import_job_id', 'ean'],
+        unique=False,
+    )
+    op.create_index(
+        'ix_allegro_cache_ean_cov',
+        'allegro_cache',
+        ['ean'],
+        unique=False,
+        postgresql_include=['lowest_price', 'sold_count', 'source', 'fetched_at'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_allegro_cache_ean_cov', table_name='allegro_cache')
+    op.drop_index('ix_product_inputs_job_ean', table_name='product_inputs')
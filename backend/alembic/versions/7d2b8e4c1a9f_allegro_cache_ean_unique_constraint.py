@@ -0,0 +1,35 @@
+"""Named unique constraint for allegro_cache.ean
+
+The constraint is the ON CONFLICT (ean) target; lookups by ean use it or the
+covering ix_allegro_cache_ean_cov, so no further index on ean is needed.
+
+Revision ID: 7d2b8e4c1a9f
+Revises: 3c9e1f2a7b4d
+Create Date: 2026-10-14 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2b8e4c1a9f'
+down_revision: Union[str, Sequence[str], None] = '3c9e1f2a7b4d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index(op.f('ix_allegro_cache_ean'), table_name='allegro_cache')
+    with op.batch_alter_table('allegro_cache') as batch_op:
+        batch_op.create_unique_constraint('uq_allegro_cache_ean', ['ean'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('allegro_cache') as batch_op:
+        batch_op.drop_constraint('uq_allegro_cache_ean', type_='unique')
+    op.create_index(op.f('ix_allegro_cache_ean'), 'allegro_cache', ['ean'], unique=True)
@@ -0,0 +1,59 @@
+"""Server-side timezone-aware timestamps
+
+Revision ID: a41f6c0d2e57
+Revises: 7d2b8e4c1a9f
+Create Date: 2026-10-14 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f6c0d2e57'
+down_revision: Union[str, Sequence[str], None] = '7d2b8e4c1a9f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (tabela, kolumna, wartosc dla NULL) - dotychczasowe wartosci byly zapisywane
+# jako UTC (datetime.utcnow). Cache bez daty traktujemy jako przeterminowany.
+TIMESTAMP_COLUMNS = (
+    ('import_jobs', 'created_at', 'CURRENT_TIMESTAMP'),
+    ('product_inputs', 'created_at', 'CURRENT_TIMESTAMP'),
+    ('allegro_cache', 'fetched_at', "'1970-01-01 00:00:00'"),
+    ('exports', 'created_at', 'CURRENT_TIMESTAMP'),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table, column, fallback in TIMESTAMP_COLUMNS:
+        op.execute(
+            sa.text(f"UPDATE {table} SET {column} = {fallback} WHERE {column} IS NULL")
+        )
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                column,
+                existing_type=sa.DateTime(),
+                type_=sa.DateTime(timezone=True),
+                server_default=sa.func.now(),
+                nullable=False,
+                postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, column, _ in TIMESTAMP_COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                column,
+                existing_type=sa.DateTime(timezone=True),
+                type_=sa.DateTime(),
+                server_default=None,
+                nullable=True,
+                postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+            )
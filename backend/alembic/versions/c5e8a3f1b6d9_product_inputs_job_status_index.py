@@ -0,0 +1,33 @@
+"""Add (import_job_id, status) index on product_inputs
+
+Revision ID: c5e8a3f1b6d9
+Revises: a41f6c0d2e57
+Create Date: 2026-10-14 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e8a3f1b6d9'
+down_revision: Union[str, Sequence[str], None] = 'a41f6c0d2e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_product_inputs_job_status',
+        'product_inputs',
+        ['import_job_id', 'status'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_inputs_job_status', table_name='product_inputs')
@@ -0,0 +1,44 @@
+"""Add product_inputs.updated_at for incremental product listing
+
+Revision ID: e2f7b9a4c3d1
+Revises: c5e8a3f1b6d9
+Create Date: 2026-10-15 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2f7b9a4c3d1'
+down_revision: Union[str, Sequence[str], None] = 'c5e8a3f1b6d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('product_inputs') as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                'updated_at',
+                sa.DateTime(timezone=True),
+                server_default=sa.func.now(),
+                nullable=False,
+            )
+        )
+    op.create_index(
+        'ix_product_inputs_job_updated',
+        'product_inputs',
+        ['import_job_id', 'updated_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_inputs_job_updated', table_name='product_inputs')
+    with op.batch_alter_table('product_inputs') as batch_op:
+        batch_op.drop_column('updated_at')
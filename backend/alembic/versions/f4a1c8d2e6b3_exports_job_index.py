@@ -0,0 +1,28 @@
+"""Add import_job_id index on exports
+
+Revision ID: f4a1c8d2e6b3
+Revises: e2f7b9a4c3d1
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a1c8d2e6b3'
+down_revision: Union[str, Sequence[str], None] = 'e2f7b9a4c3d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_exports_job', 'exports', ['import_job_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_exports_job', table_name='exports')
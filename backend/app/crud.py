@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Session
 from . import models, schemas
-from datetime import datetime
+from datetime import datetime, timezone
 
 # -----------------------
 # ImportJob CRUD
@@ -13,13 +13,13 @@ def create_import_job(db: Session, filename: str, user_id: int = None):
     return job
 
 def get_import_job(db: Session, job_id: int):
-    return db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+    return db.get(models.ImportJob, job_id)
 
 def list_import_jobs(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.ImportJob).offset(skip).limit(limit).all()
 
 def update_import_job_status(db: Session, job_id: int, status: str):
-    job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+    job = db.get(models.ImportJob, job_id)
     if job:
         job.status = status
         db.commit()
@@ -44,13 +44,13 @@ def create_product_input(db: Session, product: schemas.ProductInputCreate):
     return db_product
 
 def get_product_input(db: Session, product_id: int):
-    return db.query(models.ProductInput).filter(models.ProductInput.id == product_id).first()
+    return db.get(models.ProductInput, product_id)
 
 def list_product_inputs_by_job(db: Session, job_id: int):
     return db.query(models.ProductInput).filter(models.ProductInput.import_job_id == job_id).all()
 
 def update_product_input_status(db: Session, product_id: int, status: str):
-    product = db.query(models.ProductInput).filter(models.ProductInput.id == product_id).first()
+    product = db.get(models.ProductInput, product_id)
     if product:
         product.status = status
         db.commit()
@@ -64,26 +64,53 @@ def get_allegro_cache(db: Session, ean: str):
     return db.query(models.AllegroCache).filter(models.AllegroCache.ean == ean).first()
 
 def create_or_update_allegro_cache(db: Session, ean: str, lowest_price: float, sold_count: int, source: str, not_found: bool = False):
+    values = dict(
+        ean=ean,
+        lowest_price=lowest_price,
+        sold_count=sold_count,
+        source=source,
+        fetched_at=datetime.now(timezone.utc),
+        not_found=not_found,
+    )
+    upsert_stmt = upsert_allegro_cache_stmt(db, values)
+    if upsert_stmt is not None:
+        # jeden INSERT ... ON CONFLICT (ean) DO UPDATE zamiast SELECT + INSERT/UPDATE
+        db.execute(upsert_stmt)
+        db.commit()
+        cache = get_allegro_cache(db, ean)
+        db.refresh(cache)  # obiekt moze juz byc w identity map z poprzednimi wartosciami
+        return cache
+
     cache = get_allegro_cache(db, ean)
     if cache:
-        cache.lowest_price = lowest_price
-        cache.sold_count = sold_count
-        cache.source = source
-        cache.fetched_at = datetime.utcnow()
-        cache.not_found = not_found
+        for key, value in values.items():
+            setattr(cache, key, value)
     else:
-        cache = models.AllegroCache(
-            ean=ean,
-            lowest_price=lowest_price,
-            sold_count=sold_count,
-            source=source,
-            not_found=not_found
-        )
+        cache = models.AllegroCache(**values)
         db.add(cache)
     db.commit()
     db.refresh(cache)
     return cache
 
+def upsert_allegro_cache_stmt(db: Session, values: dict):
+    """
+    Buduje INSERT ... ON CONFLICT (ean) DO UPDATE dla dialektow, ktore to wspieraja
+    (Postgres, SQLite); dla pozostalych zwraca None
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+
+    stmt = dialect_insert(models.AllegroCache).values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.AllegroCache.ean],
+        set_={key: stmt.excluded[key] for key in values if key != "ean"},
+    )
+
 # -----------------------
 # Export CRUD
 # -----------------------
@@ -1,12 +1,64 @@
+import orjson
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from .config import DATABASE_URL
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from .config import (
+    DATABASE_URL,
+    DB_INSERTMANYVALUES_PAGE_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_PREPARE_THRESHOLD,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+)
 
-# engine
-engine = create_engine(DATABASE_URL, echo=False)
 
-# session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _json_dumps(value) -> str:
+    # SQLAlchemy oczekuje str, orjson zwraca bytes
+    return orjson.dumps(value).decode()
+
+
+_db_url = make_url(DATABASE_URL)
+connect_args = {}
+engine_kwargs = {}
+if _db_url.get_backend_name() == "postgresql":
+    # krotkie zapytania OLTP - koszt kompilacji JIT sie nie zwraca
+    connect_args["options"] = "-c jit=off"
+    if _db_url.get_driver_name() == "psycopg":
+        connect_args["prepare_threshold"] = DB_PREPARE_THRESHOLD
+    elif _db_url.get_driver_name() == "psycopg2":
+        # INSERT-y jako wielowierszowe VALUES, UPDATE/DELETE przez execute_batch
+        engine_kwargs["executemany_mode"] = "values_plus_batch"
+
+# engine - pula polaczen trzyma "cieple" sesje TCP+auth zamiast laczyc sie per request;
+# pre_ping + recycle chronia przed zerwanymi polaczeniami (Postgres/pgbouncer)
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    future=True,
+    # executemany INSERT-ow (import ProductInput) - tyle wierszy w jednym INSERT ... VALUES
+    insertmanyvalues_page_size=DB_INSERTMANYVALUES_PAGE_SIZE,
+    # kolumny JSON (ImportJob.meta) kodowane orjson zamiast modulu json
+    json_serializer=_json_dumps,
+    json_deserializer=orjson.loads,
+    connect_args=connect_args,
+    **engine_kwargs,
+)
+
+# session factory - expire_on_commit=False: po commit nie robimy ponownego SELECT
+# przy dostepie do atrybutow (np. job.id w start_import, bez db.refresh)
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
+
+# sesja per watek workera Celery - kolejne zadania uzywaja tego samego obiektu
+# Session (close() po zadaniu oddaje polaczenie do puli i czysci identity map)
+TaskSession = scoped_session(SessionLocal)
 
 # baza modeli
 Base = declarative_base()
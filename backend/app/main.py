@@ -1,30 +1,77 @@
 # Plik: backend/app/main.py
 
-import os
-import uuid
+import asyncio
+import csv
+import hashlib
+import io
+import secrets
 import shutil
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException
-from .database import Base, engine, get_db
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from fastapi import FastAPI, UploadFile, File, Form, Depends, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
+from pydantic import TypeAdapter
+from .database import Base, SessionLocal, engine, get_db
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import Float, Numeric, and_, case, cast, func, inspect, or_, select
 from . import models, tasks
 # Poprawka: Importujemy też config dla mnożnika
 from . import config 
-from .schemas import ImportStartResponse, JobStatus, ProductAnalysis
+from .schemas import ImportStartResponse, JobSnapshot, JobStatus, ProductAnalysis
 from pathlib import Path
-from dotenv import load_dotenv
+from typing import Optional
 
-load_dotenv()
 
-Base.metadata.create_all(bind=engine)
+def _ensure_tables() -> None:
+    """Tworzy brakujace tabele (tylko gdy czegos brakuje w bazie)."""
 
-app = FastAPI(title="Import Service Pilot")
+    existing = set(inspect(engine).get_table_names())
+    if not set(Base.metadata.tables) <= existing:
+        Base.metadata.create_all(bind=engine)
 
-WORKSPACE = os.getenv("WORKSPACE", "/workspace")
-UPLOAD_DIR = Path(WORKSPACE) / "data" / "uploads"
-EXPORT_DIR = Path(WORKSPACE) / "data" / "exports"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+
+@lru_cache(maxsize=None)
+def _workspace_dirs() -> tuple[Path, Path]:
+    """Zwraca (UPLOAD_DIR, EXPORT_DIR); katalogi zaklada tylko raz na proces."""
+
+    # Zmienne srodowiskowe (.env) wczytuje raz config.py
+    workspace = Path(config.WORKSPACE)
+    upload_dir = workspace / "data" / "uploads"
+    export_dir = workspace / "data" / "exports"
+    for directory in (upload_dir, export_dir):
+        if not directory.is_dir():
+            directory.mkdir(parents=True, exist_ok=True)
+    return upload_dir, export_dir
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Raz na proces przy starcie, a nie przy imporcie modulu
+    _workspace_dirs()
+    if config.AUTO_CREATE_TABLES:
+        await run_in_threadpool(_ensure_tables)
+    yield
+
+
+# JSON odpowiedzi kodowany przez orjson, a nie modul json
+app = FastAPI(
+    title="Import Service Pilot",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _save_upload(src, filepath: Path) -> None:
+    """Zapisuje plik uploadu na dysk (``shutil.copyfileobj`` z duzym buforem)."""
+    src.seek(0)
+    with open(filepath, "wb") as f:
+        shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
 
 
 @app.post("/api/imports/start", response_model=ImportStartResponse)
@@ -34,67 +81,57 @@ async def start_import(
     currency: str = Form(...),
     db: Session = Depends(get_db)
 ):
-    filename = f"{uuid.uuid4().hex}_{file.filename}"
-    filepath = UPLOAD_DIR / filename
+    filename = f"{secrets.token_hex(16)}_{file.filename}"
+    upload_dir, _ = _workspace_dirs()
+    filepath = upload_dir / filename
     try:
-        with open(filepath, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        # kopiowanie poza petla zdarzen, zeby nie blokowac innych requestow
+        await run_in_threadpool(_save_upload, file.file, filepath)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Nie można zapisać pliku: {e}")
 
     # --- POPRAWKA BŁĘDU TypeError ---
     # Zapisujemy 'category' i 'currency' w polu 'meta' (JSON)
     # Model ImportJob nie ma już pola 'category'
+    # Job od razu ma status "queued" - jeden INSERT (id przez RETURNING) i jeden
+    # commit przed kolejkowaniem, wiec worker nie moze go wyprzedzic i nie
+    # potrzebujemy juz warunkowego UPDATE pending -> queued.
     job = models.ImportJob(
-        filename=str(filepath.name),
-        status="pending",
-        # Usunięto: category=category,
+        filename=filepath.name,
+        status="queued",
         meta={"currency": currency, "category": category}, # <-- Poprawny zapis
         # Dodajemy multiplier z configu, jak w modelu
         multiplier=config.PROFIT_MULTIPLIER 
     )
     # --- KONIEC POPRAWKI ---
-    
+
     db.add(job)
     db.commit()
-    db.refresh(job)
 
     try:
         # Uruchamiamy zadanie Celery
         tasks.parse_import_file.delay(job.id, str(filepath))
-
-        # Ustawiamy status "queued" tylko jeśli zadanie nie zdążyło jeszcze
-        # przejść w stan "processing" (może się to stać bardzo szybko, zanim
-        # backend zdąży wykonać commit). Dzięki temu unikamy nadpisywania
-        # informacji ustawionej już przez worker.
-        rows_updated = (
-            db.query(models.ImportJob)
-            .filter(
-                models.ImportJob.id == job.id,
-                models.ImportJob.status.in_(["pending", "queued"]),
-            )
-            .update({"status": "queued"}, synchronize_session=False)
-        )
-        if rows_updated:
-            db.commit()
-        else:
-            db.rollback()
     except Exception as e:
         # Błąd przy kolejkowaniu (np. Redis nie działa)
         job.status = "error"
         job.notes = f"Błąd kolejkowania Celery: {e}"
         db.commit()
-        raise HTTPException(status_code=500, detail=f"Błąd Celery: {e}")
+        raise HTTPException(status_code=503, detail=f"Błąd Celery: {e}")
 
     return {"job_id": job.id, "message": "Plik zapisany, zadanie parsowania zakolejkowane."}
 
 
 @app.get("/api/imports/{job_id}/status", response_model=JobStatus)
 def job_status(job_id: int, db: Session = Depends(get_db)):
-    job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+    job = db.get(models.ImportJob, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    return _job_progress(db, job)
+
 
+def _job_progress(db: Session, job: models.ImportJob) -> dict:
+    """Stan joba z licznikami produktow (jedno GROUP BY status)."""
+    job_id = job.id
     status_counts = (
         db.query(models.ProductInput.status, func.count(models.ProductInput.id))
         .filter(models.ProductInput.import_job_id == job_id)
@@ -123,68 +160,363 @@ def job_status(job_id: int, db: Session = Depends(get_db)):
     }
 
 
+_JOB_FINAL_STATUSES = ("done", "error")
+
+
+def _read_job_progress(job_id: int) -> Optional[dict]:
+    with SessionLocal() as db:
+        job = db.get(models.ImportJob, job_id)
+        return _job_progress(db, job) if job else None
+
+
+async def _job_event_stream(job_id: int):
+    """
+    Serwer sprawdza stan co JOB_EVENTS_POLL_SECONDS, a klient dostaje zdarzenie
+    tylko przy zmianie; w ciszy komentarz keep-alive. Strumien konczy sie,
+    gdy job jest zakonczony (lub zniknal).
+    """
+    last, idle_since = None, asyncio.get_running_loop().time()
+    while True:
+        progress = await run_in_threadpool(_read_job_progress, job_id)
+        if progress is None:
+            return
+        now = asyncio.get_running_loop().time()
+        if progress != last:
+            yield b"data: " + orjson.dumps(progress) + b"\n\n"
+            last, idle_since = progress, now
+        elif now - idle_since >= config.JOB_EVENTS_KEEPALIVE_SECONDS:
+            yield b": keep-alive\n\n"
+            idle_since = now
+        if progress["status"] in _JOB_FINAL_STATUSES:
+            return
+        await asyncio.sleep(config.JOB_EVENTS_POLL_SECONDS)
+
+
+@app.get("/api/imports/{job_id}/events")
+def job_events(job_id: int, db: Session = Depends(get_db)):
+    """Server-sent events z tym samym JSON-em co /status - zamiast odpytywania co kilka sekund."""
+    if db.get(models.ImportJob, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        _job_event_stream(job_id),
+        media_type="text/event-stream",
+        # bez buforowania po drodze (nginx) - zdarzenia maja dochodzic od razu
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Rekomendacje jako internowane stale - w petli tylko referencja, bez nowych napisow
+_REC_PROFITABLE = sys.intern("opłacalny")
+_REC_UNPROFITABLE = sys.intern("nieopłacalny")
+_REC_NONE = sys.intern("brak danych")
+_REC_MISSING = sys.intern("brak na Allegro")
+_REC_ERR = sys.intern("błąd pobierania")
+_REC_INFLIGHT = sys.intern("w trakcie...")
+_RECOMMENDATIONS = (
+    _REC_PROFITABLE,
+    _REC_UNPROFITABLE,
+    _REC_NONE,
+    _REC_MISSING,
+    _REC_ERR,
+    _REC_INFLIGHT,
+)
+(
+    _REC_IDX_PROFITABLE,
+    _REC_IDX_UNPROFITABLE,
+    _REC_IDX_NONE,
+    _REC_IDX_MISSING,
+    _REC_IDX_ERR,
+    _REC_IDX_INFLIGHT,
+) = range(len(_RECOMMENDATIONS))
+
+# now() w Postgresie to poczatek transakcji - wiersz moze zostac zatwierdzony
+# z nieco starszym updated_at niz ostatni odczyt klienta, wiec okno ?since=
+# cofamy o zapas (frontend scala wiersze po id, powtorki sa nieszkodliwe)
+_SINCE_OVERLAP = timedelta(seconds=30)
+
+
+def _products_etag(
+    db: Session, job: models.ImportJob, multiplier: float, since: Optional[datetime] = None
+) -> str:
+    """
+    ETag listy produktow: liczba wierszy joba, najnowszy updated_at (kazda
+    zmiana statusu go podbija) i najnowszy fetched_at z cache dla EAN-ow joba -
+    ponowny scrape EAN-u przez inny job tez zmienia tresc listy. Oba agregaty
+    to index-only scany (ix_product_inputs_job_updated, ix_allegro_cache_ean_cov),
+    bez JOIN-a. `since` wchodzi do tagu, bo delta to inna tresc niz pelna lista.
+    """
+
+    P = models.ProductInput
+    C = models.AllegroCache
+    job_eans = select(P.ean).where(P.import_job_id == job.id)
+    cache_ts = select(func.max(C.fetched_at)).where(C.ean.in_(job_eans)).scalar_subquery()
+    count, updated_at, fetched_at = db.execute(
+        select(func.count(), func.max(P.updated_at), cache_ts).where(P.import_job_id == job.id)
+    ).one()
+    parts = [
+        job.status, str(multiplier), str(count), str(updated_at), str(fetched_at), str(since),
+    ]
+    return '"%s"' % hashlib.sha1(":".join(parts).encode()).hexdigest()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _products_query(job_id: int, multiplier: float):
+    """SELECT wynikow joba (produkt + cache + marza i indeks rekomendacji)."""
+
+    P = models.ProductInput
+    C = models.AllegroCache
+
+    # Marza i rekomendacja liczone po stronie bazy (jeden SELECT z LEFT JOIN).
+    # round() w Postgresie wymaga typu numeric, stad rzutowania.
+    has_price = and_(
+        P.status == "done",
+        C.lowest_price.isnot(None),
+        P.purchase_price.isnot(None),
+    )
+    profit_margin = case(
+        (
+            and_(has_price, P.purchase_price > 0),
+            cast(func.round(cast(C.lowest_price / P.purchase_price, Numeric), 2), Float),
+        ),
+        else_=None,
+    )
+    # Baza zwraca tylko indeks rekomendacji - napis bierzemy z krotki stalych
+    recommendation = case(
+        (and_(has_price, P.purchase_price > 0, profit_margin >= multiplier), _REC_IDX_PROFITABLE),
+        (and_(has_price, P.purchase_price > 0), _REC_IDX_UNPROFITABLE),
+        (has_price, _REC_IDX_PROFITABLE),  # Cena zakupu 0
+        (P.status == "done", _REC_IDX_NONE),
+        (P.status == "not_found", _REC_IDX_MISSING),
+        (P.status == "error", _REC_IDX_ERR),
+        (P.status.in_(["pending", "queued", "processing"]), _REC_IDX_INFLIGHT),
+        else_=_REC_IDX_NONE,
+    )
+
+    return (
+        select(
+            P.id,
+            P.ean,
+            P.name,
+            P.purchase_price,
+            P.status,
+            P.notes,
+            P.updated_at,
+            C.lowest_price,
+            C.sold_count,
+            C.source,
+            C.fetched_at,
+            profit_margin.label("profit_margin"),
+            recommendation.label("recommendation"),
+        )
+        .select_from(P)
+        .join(C, C.ean == P.ean, isouter=True)
+        .where(P.import_job_id == job_id)
+        .order_by(P.id)
+        # lekkie krotki Row strumieniowane paczkami (server-side cursor na Postgresie)
+        .execution_options(yield_per=1000)
+    )
+
+
+# Cala lista serializowana jednym wywolaniem pydantic-core (Rust) - bez
+# walidacji response_model wiersz po wierszu przed wyslaniem
+_PRODUCT_LIST = TypeAdapter(list[ProductAnalysis])
+
+
 @app.get("/api/imports/{job_id}/products", response_model=list[ProductAnalysis])
-def list_products(job_id: int, db: Session = Depends(get_db)):
-    job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+def list_products(
+    job_id: int,
+    since: Optional[datetime] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Wyniki joba. Z ?since=<iso_ts> zwraca tylko wiersze zmienione od tego
+    momentu; naglowek X-Latest-Ts podaje wartosc do nastepnego zapytania.
+    """
+    job = db.get(models.ImportJob, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    products = (
-        db.query(models.ProductInput)
-        .filter(models.ProductInput.import_job_id == job_id)
-        .all()
-    )
-    
-    results = []
-    
-    # Pobierz wszystkie cache jednym zapytaniem (optymalizacja)
-    eans = [p.ean for p in products]
-    cache_data = db.query(models.AllegroCache).filter(models.AllegroCache.ean.in_(eans)).all()
-    cache_map = {c.ean: c for c in cache_data}
-    
     # Użyj mnożnika zapisanego w jobie (zgodnie z MVP to 1.5)
     multiplier = job.multiplier if job.multiplier else config.PROFIT_MULTIPLIER
 
-    for p in products:
-        cache = cache_map.get(p.ean)
-        
-        lowest_price = cache.lowest_price if cache else None
-        sold_count = cache.sold_count if cache else None
-        source = cache.source if cache else None
-        last_checked = cache.fetched_at if cache else None
-        profit_margin = None
-        recommendation = "brak danych" # Domyślnie
-
-        if p.status == "done" and lowest_price is not None and p.purchase_price is not None:
-            if p.purchase_price > 0:
-                profit_margin = round(lowest_price / p.purchase_price, 2)
-                recommendation = (
-                    "opłacalny"
-                    if profit_margin >= multiplier else "nieopłacalny"
+    # ETag z lekkich agregatow (liczba wierszy, updated_at, fetched_at z cache), zeby
+    # powtarzajace sie odpytywanie nie wykonywalo ciezkiego JOIN-a ani serializacji
+    etag = _products_etag(db, job, multiplier, since)
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    headers = {
+        "ETag": etag,
+        # delta (?since=) zalezy od stanu klienta - tylko pelna lista zakonczonego
+        # joba moze trafic do wspolnego cache; zawsze z rewalidacja, bo ponowny
+        # scrape EAN-u przez inny job zmienia liste takze po zakonczeniu joba
+        "Cache-Control": (
+            "public, no-cache" if job.status == "done" and since is None else "private, no-cache"
+        ),
+    }
+
+    products, latest = _product_rows(db, job_id, multiplier, since)
+    if latest is not None:
+        headers["X-Latest-Ts"] = latest.isoformat()
+    return Response(
+        _PRODUCT_LIST.dump_json(products), media_type="application/json", headers=headers
+    )
+
+
+def _product_rows(db: Session, job_id: int, multiplier: float, since: Optional[datetime]) -> tuple:
+    """Wiersze ProductAnalysis (wszystkie albo zmienione od `since`) i najnowszy znacznik czasu."""
+
+    P = models.ProductInput
+    C = models.AllegroCache
+
+    stmt = _products_query(job_id, multiplier)
+    if since is not None:
+        # zmiana statusu wiersza albo odswiezenie cache dla jego EAN-u
+        window = since - _SINCE_OVERLAP
+        stmt = stmt.where(or_(P.updated_at >= window, C.fetched_at >= window))
+
+    # Typy pochodza prosto z bazy - pomijamy walidacje Pydantic przy budowie
+    products = [
+        ProductAnalysis.model_construct(
+            id=row.id,
+            ean=row.ean,
+            name=row.name,
+            purchase_price=row.purchase_price,
+            lowest_price_allegro=row.lowest_price,
+            sold_count=row.sold_count,
+            source=row.source,
+            last_checked=row.fetched_at,
+            profit_margin=row.profit_margin,
+            recommendation=_RECOMMENDATIONS[row.recommendation],
+            notes=row.notes,
+            # Dodajmy status, aby frontend mógł go widzieć
+            status=row.status,
+            updated_at=row.updated_at,
+        )
+        for row in db.execute(stmt)
+    ]
+    latest = max(
+        (ts for p in products for ts in (p.updated_at, p.last_checked) if ts is not None),
+        default=since,
+    )
+    return products, latest
+
+
+@app.get("/api/imports/{job_id}", response_model=JobSnapshot)
+def job_snapshot(
+    job_id: int,
+    since: Optional[datetime] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Status joba i produkty w jednej odpowiedzi (jedno zapytanie na odswiezenie).
+    Parametry jak w /products; gdy If-None-Match pasuje, `products` = null.
+    """
+    job = db.get(models.ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    multiplier = job.multiplier if job.multiplier else config.PROFIT_MULTIPLIER
+
+    snapshot = _job_progress(db, job)
+    etag = _products_etag(db, job, multiplier, since)
+    snapshot["products_etag"] = etag
+    snapshot["products"], snapshot["latest_ts"] = (
+        (None, since)
+        if _etag_matches(if_none_match, etag)
+        else _product_rows(db, job_id, multiplier, since)
+    )
+    # jak w /products - jedno model_dump_json zamiast walidacji response_model
+    return Response(
+        JobSnapshot.model_construct(**snapshot).model_dump_json(),
+        media_type="application/json",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+# Kolumny raportu - te same nazwy co pola ProductAnalysis w /products
+_EXPORT_COLUMNS = (
+    "ean",
+    "name",
+    "purchase_price",
+    "lowest_price_allegro",
+    "sold_count",
+    "source",
+    "last_checked",
+    "profit_margin",
+    "recommendation",
+    "notes",
+    "status",
+)
+
+
+def _export_csv_chunks(stmt):
+    """Raport CSV paczkami po yield_per wierszy - w pamieci zawsze tylko jedna paczka."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_EXPORT_COLUMNS)
+    with SessionLocal() as db:
+        for rows in db.execute(stmt).partitions():
+            writer.writerows(
+                (
+                    row.ean,
+                    row.name,
+                    row.purchase_price,
+                    row.lowest_price,
+                    row.sold_count,
+                    row.source,
+                    row.fetched_at,
+                    row.profit_margin,
+                    _RECOMMENDATIONS[row.recommendation],
+                    row.notes,
+                    row.status,
                 )
-            else:
-                recommendation = "opłacalny" # Cena zakupu 0
-        elif p.status == "not_found":
-            recommendation = "brak na Allegro"
-        elif p.status == "error":
-            recommendation = "błąd pobierania"
-        elif p.status in ["pending", "queued", "processing"]:
-            recommendation = "w trakcie..."
-
-        results.append(
-            ProductAnalysis(
-                ean=p.ean,
-                name=p.name,
-                purchase_price=p.purchase_price,
-                lowest_price_allegro=lowest_price,
-                sold_count=sold_count,
-                source=source,
-                last_checked=last_checked,
-                profit_margin=profit_margin,
-                recommendation=recommendation,
-                notes=p.notes,
-                # Dodajmy status, aby frontend mógł go widzieć
-                status=p.status 
+                for row in rows
             )
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        # sam naglowek (job bez produktow)
+        yield buffer.getvalue().encode("utf-8")
+
+
+@app.get("/api/imports/{job_id}/export.csv")
+def export_csv(
+    job_id: int,
+    status: Optional[str] = Query(None),
+    recommendation: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Raport CSV strumieniowany prosto z bazy - frontend linkuje do tego URL-a.
+    Opcjonalne filtry odpowiadaja filtrom tabeli w UI.
+    """
+    job = db.get(models.ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    multiplier = job.multiplier if job.multiplier else config.PROFIT_MULTIPLIER
+
+    stmt = _products_query(job_id, multiplier)
+    if status is not None:
+        stmt = stmt.where(models.ProductInput.status == status)
+    if recommendation is not None:
+        if recommendation not in _RECOMMENDATIONS:
+            raise HTTPException(status_code=422, detail="Unknown recommendation")
+        stmt = stmt.where(
+            stmt.selected_columns.recommendation == _RECOMMENDATIONS.index(recommendation)
         )
-    return results
+
+    # generator ma wlasna sesje - ta z Depends zamyka sie przed wyslaniem tresci
+    return StreamingResponse(
+        _export_csv_chunks(stmt),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="raport_job_{job_id}.csv"'},
+    )
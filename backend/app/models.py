@@ -1,6 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
-from datetime import datetime
 from .database import Base
 
 # -----------------------
@@ -12,7 +11,7 @@ class ImportJob(Base):
     filename = Column(String, nullable=False)
     meta = Column(JSON, nullable=True)  # przechowuje category i currency
     multiplier = Column(Float, default=1.5)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     status = Column(String, default="pending")
     notes = Column(String, nullable=True)
     products = relationship("ProductInput", back_populates="import_job")
@@ -23,6 +22,14 @@ class ImportJob(Base):
 # -----------------------
 class ProductInput(Base):
     __tablename__ = "product_inputs"
+    __table_args__ = (
+        # list_products: filtr po import_job_id + join po ean
+        Index("ix_product_inputs_job_ean", "import_job_id", "ean"),
+        # finalize_job_if_complete / job_status: GROUP BY status w obrebie joba
+        Index("ix_product_inputs_job_status", "import_job_id", "status"),
+        # list_products?since=: tylko wiersze zmienione od ostatniego odczytu
+        Index("ix_product_inputs_job_updated", "import_job_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     import_job_id = Column(Integer, ForeignKey("import_jobs.id"), nullable=False)
@@ -32,7 +39,11 @@ class ProductInput(Base):
     currency = Column(String, nullable=False)
     normalized_price = Column(Float, nullable=True)
     status = Column(String, default="pending")  # pending, queued, processing, done, not_found, error
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # ustawiane przy kazdym UPDATE (ORM i update() z Core)
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
+    )
 
     notes = Column(String, nullable=True) # <-- DODAJ TĘ LINIĘ
 
@@ -43,13 +54,23 @@ class ProductInput(Base):
 # -----------------------
 class AllegroCache(Base):
     __tablename__ = "allegro_cache"
+    __table_args__ = (
+        # unikalnosc osobno - cel dla INSERT ... ON CONFLICT (ean)
+        UniqueConstraint("ean", name="uq_allegro_cache_ean"),
+        # indeks pokrywajacy (Postgres INCLUDE) - index-only scan dla list_products
+        Index(
+            "ix_allegro_cache_ean_cov",
+            "ean",
+            postgresql_include=["lowest_price", "sold_count", "source", "fetched_at"],
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    ean = Column(String, nullable=False, unique=True, index=True)
+    ean = Column(String, nullable=False)
     lowest_price = Column(Float, nullable=True)
     sold_count = Column(Integer, nullable=True)
     source = Column(String, nullable=True)  # api / scrape / cache
-    fetched_at = Column(DateTime, default=datetime.utcnow)
+    fetched_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     not_found = Column(Boolean, default=False)
 
 # -----------------------
@@ -57,10 +78,14 @@ class AllegroCache(Base):
 # -----------------------
 class Export(Base):
     __tablename__ = "exports"
+    __table_args__ = (
+        # eksporty wyszukiwane po jobie (relacja ImportJob.exports)
+        Index("ix_exports_job", "import_job_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     import_job_id = Column(Integer, ForeignKey("import_jobs.id"), nullable=False)
     filepath = Column(String, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     import_job = relationship("ImportJob", back_populates="exports")
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Literal, Optional, List
 from datetime import datetime
 
 # -----------------------
@@ -19,8 +19,7 @@ class ImportJobResponse(ImportJobBase):
     status: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True # POPRAWKA: 'orm_mode' -> 'from_attributes'
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 # -----------------------
 # Endpoint start import
@@ -62,8 +61,7 @@ class ProductInputResponse(ProductInputBase):
     notes: Optional[str]
     created_at: datetime
 
-    class Config:
-        from_attributes = True # POPRAWKA: 'orm_mode' -> 'from_attributes'
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 # -----------------------
 # Allegro cache
@@ -85,8 +83,7 @@ class AllegroCacheResponse(AllegroCacheBase):
     fetched_at: datetime
     not_found: bool
 
-    class Config:
-        from_attributes = True # POPRAWKA: 'orm_mode' -> 'from_attributes'
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 # -----------------------
 # Export
@@ -99,13 +96,22 @@ class ExportResponse(ExportBase):
     id: int
     created_at: datetime
 
-    class Config:
-        from_attributes = True # POPRAWKA: 'orm_mode' -> 'from_attributes'
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 # -----------------------
 # Raport zbiorczy dla UI
 # -----------------------
+Recommendation = Literal[
+    "opłacalny",
+    "nieopłacalny",
+    "brak danych",
+    "brak na Allegro",
+    "błąd pobierania",
+    "w trakcie...",
+]
+
 class ProductAnalysis(BaseModel):
+    id: Optional[int] = None
     ean: str
     name: str
     purchase_price: float
@@ -114,6 +120,15 @@ class ProductAnalysis(BaseModel):
     source: Optional[str]
     last_checked: Optional[datetime]
     profit_margin: Optional[float]
-    recommendation: Optional[str]  # opłacalny / nieopłacalny / brak danych
+    recommendation: Optional[Recommendation]  # opłacalny / nieopłacalny / brak danych
     notes: Optional[str]
-    status: Optional[str] = None
\ No newline at end of file
+    status: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+# -----------------------
+# Status + produkty w jednej odpowiedzi
+# -----------------------
+class JobSnapshot(JobStatus):
+    products: Optional[List[ProductAnalysis]] = None  # None = bez zmian (ETag)
+    products_etag: Optional[str] = None
+    latest_ts: Optional[datetime] = None
@@ -1,5 +1,8 @@
 # Plik: backend/app/tasks.py
 
+import atexit
+import csv
+import io
 import os
 import pandas as pd
 from celery import Celery
@@ -9,8 +12,17 @@ import re
 import logging
 from datetime import timezone
 import time
-import json
+import openpyxl
+import orjson
 import redis
+import threading
+from collections import OrderedDict, namedtuple
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Optional
+from urllib.parse import quote
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -19,19 +31,39 @@ from seleniumbase import Driver
 # --- KONIEC ZMIAN: Importy SeleniumBase ---
 
 from kombu import Queue
-from sqlalchemy import func
+from sqlalchemy import func, insert, or_, select, update
 from sqlalchemy.orm import Session
-from celery.signals import worker_process_init
-from .database import SessionLocal, engine 
+from celery.exceptions import Retry
+from celery.signals import task_postrun, worker_process_init, worker_process_shutdown
+from .database import SessionLocal, TaskSession, engine
 
-from . import models
+from . import crud, models
 from .services.alerts import send_scraper_alert
+from .utils import as_utc, chunked, normalize_ean_series, parse_price_series
 # --- Konfiguracja cache'u ---
-from .config import CACHE_TTL_DAYS
+from .config import (
+    CACHE_TTL_DAYS,
+    CELERY_BROKER_URL,
+    FINALIZE_DEBOUNCE_SECONDS,
+    IMPORT_CHUNK_ROWS,
+    IMPORT_MAX_DELIVERIES,
+    IMPORT_STREAM_MIN_BYTES,
+    PRODUCT_COPY_THRESHOLD,
+    PROXY_PASSWORD,
+    PROXY_URL,
+    PROXY_USERNAME,
+    REDIS_URL,
+    SCRAPER_BATCH_SIZE,
+    SCRAPER_DRIVER_MAX_USES,
+    SCRAPER_HTTP_CONCURRENCY,
+    SCRAPER_HTTP_ENABLED,
+    SCRAPER_HTTP_TIMEOUT,
+    SCRAPER_LOCAL_CACHE_SECONDS,
+    SCRAPER_LOCAL_CACHE_SIZE,
+)
 
 # --- Konfiguracja Celery (bez zmian) ---
-CELERY_BROKER = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
-REDIS_URL = os.getenv("REDIS_URL", CELERY_BROKER)
+CELERY_BROKER = CELERY_BROKER_URL
 celery = Celery("app.tasks", broker=CELERY_BROKER)
 
 celery.conf.task_default_queue = "celery"
@@ -43,9 +75,22 @@ celery.conf.task_routes = {
     "app.tasks.fetch_allegro_data": {
         "queue": "scraper",
         "routing_key": "scraper",
-    }
+    },
+    "app.tasks.fetch_allegro_batch": {
+        "queue": "scraper",
+        "routing_key": "scraper",
+    },
 }
 celery.conf.worker_prefetch_multiplier = 1
+# Pula polaczen producenta - .delay() z API/parsera korzysta z cieplych polaczen
+# do Redisa zamiast otwierac nowe (TCP + auth) przy kazdej publikacji
+celery.conf.broker_pool_limit = 10
+celery.conf.broker_transport_options = {
+    "max_connections": 20,
+    "socket_keepalive": True,
+    # zadanie scrapera moze trwac dlugo - Redis nie oddaje go drugiemu workerowi przed godzina
+    "visibility_timeout": 3600,
+}
 # --- Koniec konfiguracji Celery ---
 
 
@@ -55,10 +100,28 @@ def init_db_connection(**kwargs):
     logger.info("Initializing DB connection for worker process...")
     engine.dispose(close=True)
 
+
+@task_postrun.connect
+def close_task_session(**kwargs):
+    # siatka bezpieczenstwa: zadanie nie zostawia polaczenia ani obiektow w
+    # sesji watku; sam obiekt Session zostaje dla nastepnego zadania
+    TaskSession.close()
+
+_REDIS = None
+
+
+def _get_redis() -> redis.Redis:
+    """Klient Redis wspoldzielony w procesie (wlasna pula polaczen)."""
+    global _REDIS
+    if _REDIS is None:
+        _REDIS = redis.Redis.from_url(REDIS_URL)
+    return _REDIS
+
+
 def _get_cache_ttl_days() -> int:
     """Odczyt TTL cache z Redis (klucz scraper:cache_ttl_days) z fallbackiem do env."""
     try:
-        r = redis.Redis.from_url(REDIS_URL)
+        r = _get_redis()
         raw = r.get("scraper:cache_ttl_days")
         if raw:
             val = int(raw)
@@ -67,6 +130,26 @@ def _get_cache_ttl_days() -> int:
         pass
     return CACHE_TTL_DAYS
 
+def enqueue_fetch_tasks(task_payloads, chunk_size: int = 500) -> None:
+    """
+    Kolejkuje pobieranie danych dla listy (product_id, ean).
+
+    Przy SCRAPER_BATCH_SIZE > 1 EAN-y ida paczkami do fetch_allegro_batch
+    (rownolegle HTTP w jednym zadaniu), w przeciwnym razie po jednym zadaniu
+    fetch_allegro_data na produkt. Wszystkie publikacje ida przez jednego
+    producenta (jedno polaczenie z puli) zamiast pobierac polaczenie przy
+    kazdym .delay().
+    """
+    if SCRAPER_BATCH_SIZE > 1:
+        messages = [(fetch_allegro_batch, (batch,)) for batch in chunked(task_payloads, SCRAPER_BATCH_SIZE)]
+    else:
+        messages = [(fetch_allegro_data, payload) for payload in task_payloads]
+    for batch in chunked(messages, chunk_size):
+        with celery.producer_or_acquire() as producer:
+            for task, args in batch:
+                task.apply_async(args, producer=producer)
+
+
 def with_db_session(func):
     """Decorator to provide a db session to a task."""
     def wrapper(*args, **kwargs):
@@ -90,44 +173,47 @@ def update_job_error(db: Session, job: models.ImportJob, message: str):
     job.status = "error"
     job.notes = message
 ACTIVE_STATUSES = {"pending", "queued", "processing"}
+# parser commituje i kolejkuje plik paczkami - do konca parsowania job nie jest finalizowany
+_PARSING_FLAG_TTL = 3600
+
+
+def _set_parsing(import_job_id: int, active: bool) -> None:
+    key = f"parsing:{import_job_id}"
+    try:
+        if active:
+            _get_redis().set(key, "1", ex=_PARSING_FLAG_TTL)
+        else:
+            _get_redis().delete(key)
+    except Exception as e:
+        logger.warning(f"[parse] parsing flag unavailable for job {import_job_id}: {e}")
+
+
+def _is_parsing(import_job_id: int) -> bool:
+    try:
+        return bool(_get_redis().exists(f"parsing:{import_job_id}"))
+    except Exception:
+        return False
+
+# zrodla cache, ktorych nie traktujemy jako waznego wyniku (trzeba scrapowac ponownie)
+INVALID_CACHE_SOURCES = ['failed', 'error', 'ban_detected', 'captcha_detected', 'antibot_error', 'selenium_error', 'selenium_timeout']
 @with_db_session
 def finalize_job_if_complete(db: Session, import_job_id: int) -> None:
-    remaining = (
-        db.query(models.ProductInput)
-        .filter(
-            models.ProductInput.import_job_id == import_job_id,
-            models.ProductInput.status.in_(ACTIVE_STATUSES),
-        )
-        .count()
-    )
-    if remaining: return
-    job = (
-        db.query(models.ImportJob)
-        .filter(models.ImportJob.id == import_job_id)
-        .first()
-    )
-    if not job: return
-    total_products = (
-        db.query(func.count(models.ProductInput.id))
+    if _is_parsing(import_job_id): return
+    job = db.get(models.ImportJob, import_job_id)
+    # job bez produktow po nieudanym parsowaniu - nie nadpisujemy prawdziwego bledu
+    if not job or job.status == "error": return
+    # jedno GROUP BY status zamiast czterech osobnych COUNT-ow
+    counts = dict(
+        db.query(models.ProductInput.status, func.count(models.ProductInput.id))
         .filter(models.ProductInput.import_job_id == import_job_id)
-        .scalar() or 0
-    )
-    error_count = (
-        db.query(func.count(models.ProductInput.id))
-        .filter(
-            models.ProductInput.import_job_id == import_job_id,
-            models.ProductInput.status == "error",
-        )
-        .scalar() or 0
-    )
-    not_found_count = (
-        db.query(func.count(models.ProductInput.id))
-        .filter(
-            models.ProductInput.import_job_id == import_job_id,
-            models.ProductInput.status == "not_found",
-        )
-        .scalar() or 0
+        .group_by(models.ProductInput.status)
+        .all()
     )
+    remaining = sum(counts.get(s, 0) for s in ACTIVE_STATUSES)
+    if remaining: return
+    total_products = sum(counts.values())
+    error_count = counts.get("error", 0)
+    not_found_count = counts.get("not_found", 0)
     if total_products == 0:
         job.status = "error"
         job.notes = "Brak produktów po przetwarzaniu."
@@ -144,63 +230,242 @@ def finalize_job_if_complete(db: Session, import_job_id: int) -> None:
             job.notes = f"Zakończono. Nie znaleziono: {not_found_count}/{total_products}."
         else:
             job.notes = None
+
+
+@celery.task(ignore_result=True)
+def finalize_job_task(import_job_id: int) -> None:
+    finalize_job_if_complete(import_job_id)
+
+
+def schedule_finalize(import_job_id: int) -> None:
+    """
+    Zamiast liczyc statusy po kazdym fetchu, pierwszy fetch w oknie
+    FINALIZE_DEBOUNCE_SECONDS zaklada klucz w Redis i planuje jedno
+    sprawdzenie po uplywie okna; kolejne fetche w tym oknie nic nie robia.
+    Countdown == TTL klucza, wiec sprawdzenie widzi wszystkie commity,
+    ktore trafily na zajety klucz.
+    """
+    try:
+        if not _get_redis().set(f"finalize:{import_job_id}", "1", nx=True, ex=FINALIZE_DEBOUNCE_SECONDS):
+            return
+        finalize_job_task.apply_async((import_job_id,), countdown=FINALIZE_DEBOUNCE_SECONDS)
+    except Exception as e:
+        logger.warning(f"[finalize] debounce unavailable for job {import_job_id}, finalizing inline: {e}")
+        finalize_job_if_complete(import_job_id)
+
+
+# Komorki importu jako napisy Arrow: strip/replace/to_numeric ida przez kernele
+# utf8_* pyarrow zamiast po obiekcie Pythona na komorke (i zajmuja mniej pamieci)
+try:
+    import pyarrow  # noqa: F401
+    _TEXT_DTYPE = "string[pyarrow]"
+except ImportError:
+    _TEXT_DTYPE = "string"
+
+
+def read_table(filepath: str, usecols=None) -> pd.DataFrame:
+    """Wczytuje CSV/XLSX bez naglowka, wszystkie komorki jako tekst (opcjonalnie tylko usecols)."""
+    if not filepath.lower().endswith(".xlsx"):
+        try:
+            # wielowatkowy parser Arrow; przy braku pyarrow albo nietypowym pliku
+            # (np. rozna liczba kolumn w wierszach) wracamy do parsera C
+            return pd.read_csv(filepath, header=None, dtype=_TEXT_DTYPE, usecols=usecols, engine="pyarrow")
+        except Exception:
+            return pd.read_csv(filepath, header=None, dtype=_TEXT_DTYPE, usecols=usecols)
+    try:
+        # calamine (Rust) jest kilkukrotnie szybszy od openpyxl
+        return pd.read_excel(filepath, header=None, dtype=_TEXT_DTYPE, usecols=usecols, engine="calamine")
+    except ImportError:
+        return pd.read_excel(filepath, header=None, dtype=_TEXT_DTYPE, usecols=usecols)
+
+
+# Tyle wierszy z poczatku pliku wystarcza do wykrycia naglowka (15) i kolumn (+50)
+_LAYOUT_SAMPLE_ROWS = 100
+
+
+def read_table_chunks(filepath: str):
+    """
+    Zwraca (poczatek pliku, read_chunks), zawsze bez naglowka.
+
+    ``read_chunks(usecols)`` iteruje po ramkach z calym plikiem, zawezonych
+    do kolumn ``usecols`` (rosnaco; w ramce maja numery 0..n-1). CSV czytany
+    jest tylko w tych kolumnach - probka do wykrycia ukladu to osobne
+    nrows=_LAYOUT_SAMPLE_ROWS. Duze CSV (read_csv chunksize) i XLSX (openpyxl
+    read_only) czytane sa strumieniowo po IMPORT_CHUNK_ROWS wierszy; maly
+    XLSX wczytywany jest raz i dzielony w pamieci. Indeks wierszy jest
+    ciagly miedzy ramkami.
+    """
+    large = os.path.getsize(filepath) > IMPORT_STREAM_MIN_BYTES
+    if filepath.lower().endswith(".xlsx"):
+        if large:
+            return _xlsx_head(filepath), lambda usecols: _xlsx_chunks(filepath, usecols)
+        df_raw = read_table(filepath)
+        return df_raw.head(_LAYOUT_SAMPLE_ROWS), lambda usecols: _frame_chunks(df_raw.iloc[:, usecols])
+
+    head = pd.read_csv(filepath, header=None, dtype=_TEXT_DTYPE, nrows=_LAYOUT_SAMPLE_ROWS)
+    return head, lambda usecols: _csv_chunks(filepath, usecols, stream=large)
+
+
+def _numbered(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = range(df.shape[1])
+    return df
+
+
+def _frame_chunks(df: pd.DataFrame):
+    df = _numbered(df)
+    return (df.iloc[i:i + IMPORT_CHUNK_ROWS] for i in range(0, len(df), IMPORT_CHUNK_ROWS))
+
+
+def _csv_chunks(filepath: str, usecols, stream: bool):
+    if not stream:
+        yield from _frame_chunks(read_table(filepath, usecols))
+        return
+    for chunk in pd.read_csv(filepath, header=None, dtype=_TEXT_DTYPE, usecols=usecols, chunksize=IMPORT_CHUNK_ROWS):
+        yield _numbered(chunk)
+
+
+def _xlsx_rows(filepath: str, usecols=None):
+    """
+    Wiersze aktywnego arkusza jako krotki tekstow (None dla pustych komorek).
+    openpyxl read_only czyta arkusz strumieniowo, bez budowania calego drzewa XML.
+    """
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            if usecols is not None:
+                row = [row[i] if i < len(row) else None for i in usecols]
+            yield tuple(None if v is None else str(v) for v in row)
+    finally:
+        wb.close()
+
+
+def _xlsx_head(filepath: str) -> pd.DataFrame:
+    return pd.DataFrame(list(islice(_xlsx_rows(filepath), _LAYOUT_SAMPLE_ROWS)), dtype=object).astype(_TEXT_DTYPE)
+
+
+def _xlsx_chunks(filepath: str, usecols):
+    """Duzy XLSX paczkami po IMPORT_CHUNK_ROWS wierszy, indeks ciagly jak w read_csv(chunksize=...)."""
+    start = 0
+    for rows in chunked(_xlsx_rows(filepath, usecols), IMPORT_CHUNK_ROWS):
+        yield pd.DataFrame(
+            rows, index=range(start, start + len(rows)), columns=range(len(usecols)), dtype=object
+        ).astype(_TEXT_DTYPE)
+        start += len(rows)
+
+
+def _header_names(header_row: pd.Series) -> list:
+    """Nazwy kolumn z wiersza naglowka (lowercase), duplikaty jak w pandas: x, x.1, ..."""
+    names, seen = [], {}
+    for i, value in enumerate(header_row):
+        name = str(value).lower() if pd.notna(value) else f"unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+_HEADER_EAN_KEYS = frozenset({'ean', 'barcode', 'kod'})
+_HEADER_NAME_KEYS = frozenset({'name', 'nazwa', 'title', 'tytuł'})
+_HEADER_PRICE_KEYS = frozenset({'price', 'cena', 'cost', 'koszt', 'netto'})
+
+
+def _keys_pattern(keys) -> str:
+    return "|".join(re.escape(key) for key in sorted(keys))
+
+
+_HEADER_EAN_PATTERN = _keys_pattern(_HEADER_EAN_KEYS)
+_HEADER_NAME_PATTERN = _keys_pattern(_HEADER_NAME_KEYS)
+_HEADER_PRICE_PATTERN = _keys_pattern(_HEADER_PRICE_KEYS)
+
+
 def find_header_row(df_head):
-    ean_keys = ['ean', 'barcode', 'kod']
-    name_keys = ['name', 'nazwa', 'title', 'tytuł']
-    price_keys = ['price', 'cena', 'cost', 'koszt', 'netto']
-    for i, row in df_head.iterrows():
-        cols_str = " ".join([str(c).lower() for c in row if pd.notna(c)])
-        has_ean = any(key in cols_str for key in ean_keys)
-        has_name = any(key in cols_str for key in name_keys)
-        has_price = any(key in cols_str for key in price_keys)
-        if (has_ean and has_price) or (has_name and has_price) or (has_ean and has_name):
-            return i 
-    return 0 
+    # wiersze sklejone spacja (klucze nie zawieraja spacji, wiec dopasowanie nie
+    # przechodzi miedzy komorkami) i jeden str.contains na klucz zamiast iterrows
+    if df_head.empty:
+        return 0
+    cells = df_head.astype("string").apply(lambda col: col.str.lower()).fillna("")
+    joined = cells.agg(" ".join, axis=1).astype("string")
+    has_ean = joined.str.contains(_HEADER_EAN_PATTERN, regex=True, na=False)
+    has_name = joined.str.contains(_HEADER_NAME_PATTERN, regex=True, na=False)
+    has_price = joined.str.contains(_HEADER_PRICE_PATTERN, regex=True, na=False)
+    mask = (has_ean & has_price) | (has_name & has_price) | (has_ean & has_name)
+    return mask.idxmax() if mask.any() else 0
+
+
+_EAN_RE = re.compile(r"\d{8}|\d{12}|\d{13}")
+_PRICE_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
 def is_ean(val):
     s = str(val).strip()
     return s.isdigit() and len(s) in [8, 12, 13]
 def is_price(val):
+    # regex gwarantuje, ze float(s) sie powiedzie - bez dodatkowej konwersji
     if val is None: return False
-    s = str(val).strip().replace(',', '.')
-    if re.fullmatch(r"^-?\d+(\.\d+)?$", s):
-        try:
-            float(s)
-            return True
-        except ValueError:
-            return False
-    return False
+    return _PRICE_RE.fullmatch(str(val).strip().replace(',', '.')) is not None
+
+
+def _best_column(counts: pd.Series, exclude=(), min_hits: int = 6) -> Optional[int]:
+    """Kolumna z najwieksza liczba trafien (>= min_hits), z pominieciem juz wybranych."""
+    counts = counts.drop([c for c in exclude if c is not None], errors="ignore")
+    if counts.empty:
+        return None
+    idx = counts.idxmax()
+    return int(idx) if counts[idx] >= min_hits else None
+
+
+# faza 1 wykrywania kolumn: tyle wierszy i tyle trafien, by rola kolumny byla przesadzona
+_QUICK_SCAN_ROWS = 10
+_QUICK_SCAN_MIN_HITS = 5
+
+
+def _content_sample(df, start_row: int, n_rows: int) -> pd.DataFrame:
+    sample = df.iloc[start_row : start_row + n_rows, :10].copy()
+    sample.columns = range(sample.shape[1])
+    return sample
+
+
+def _cell_masks(sample: pd.DataFrame) -> tuple:
+    """Maski (ean, price, text) komorek probki, liczone kolumnami przez Series.str."""
+    raw = sample.apply(lambda col: col.astype("string").fillna(""))
+    cells = raw.apply(lambda col: col.str.strip())
+    filled = cells != ""
+
+    ean_mask = cells.apply(lambda col: col.str.fullmatch(_EAN_RE.pattern)).fillna(False).astype(bool)
+    price_mask = (
+        cells.apply(lambda col: col.str.replace(",", ".", regex=False).str.fullmatch(_PRICE_RE.pattern))
+        .fillna(False)
+        .astype(bool)
+    )
+    text_mask = filled & ~ean_mask & ~price_mask & raw.apply(lambda col: col.str.len() > 3)
+    return ean_mask, price_mask, text_mask
+
+
 def find_columns_by_content(df, start_row):
-    ean_col, name_col, price_col = None, None, None
-    potential_cols = {} 
-    sample_df = df.iloc[start_row : start_row + 50]
-    for _, row in sample_df.iterrows():
-        for col_idx, cell in enumerate(row.head(10)):
-            if col_idx not in potential_cols:
-                potential_cols[col_idx] = {'ean_count': 0, 'price_count': 0, 'text_count': 0}
-            if pd.isna(cell) or str(cell).strip() == "":
-                continue
-            if is_ean(cell):
-                potential_cols[col_idx]['ean_count'] += 1
-            if is_price(cell):
-                potential_cols[col_idx]['price_count'] += 1
-            if (isinstance(cell, str) and 
-                not is_ean(cell) and 
-                not is_price(cell) and 
-                len(cell) > 3):
-                potential_cols[col_idx]['text_count'] += 1
-    best_ean = sorted(potential_cols.items(), key=lambda item: item[1]['ean_count'], reverse=True)
-    if best_ean and best_ean[0][1]['ean_count'] > 5:
-        ean_col = best_ean[0][0]
-    best_price = sorted(potential_cols.items(), key=lambda item: item[1]['price_count'], reverse=True)
-    for idx, counts in best_price:
-        if idx != ean_col and counts['price_count'] > 5:
-            price_col = idx
-            break
-    best_name = sorted(potential_cols.items(), key=lambda item: item[1]['text_count'], reverse=True)
-    for idx, counts in best_name:
-        if idx != ean_col and idx != price_col and counts['text_count'] > 5:
-            name_col = idx
-            break
+    # faza 1: pierwsze wiersze - kolumna z wyraznym wynikiem dostaje role od razu
+    quick = _content_sample(df, start_row, _QUICK_SCAN_ROWS)
+    if quick.empty:
+        return None, None, None
+    ean_mask, price_mask, text_mask = _cell_masks(quick)
+    ean_col = _best_column(ean_mask.sum(), min_hits=_QUICK_SCAN_MIN_HITS)
+    price_col = _best_column(price_mask.sum(), exclude=(ean_col,), min_hits=_QUICK_SCAN_MIN_HITS)
+    name_col = _best_column(text_mask.sum(), exclude=(ean_col, price_col), min_hits=_QUICK_SCAN_MIN_HITS)
+    if None not in (ean_col, name_col, price_col):
+        return ean_col, name_col, price_col
+
+    # faza 2: pelna probka tylko dla kolumn, ktore nie maja jeszcze roli
+    decided = [c for c in (ean_col, name_col, price_col) if c is not None]
+    sample = _content_sample(df, start_row, 50).drop(columns=decided)
+    ean_mask, price_mask, text_mask = _cell_masks(sample)
+    if ean_col is None:
+        ean_col = _best_column(ean_mask.sum(), exclude=(price_col, name_col))
+    if price_col is None:
+        price_col = _best_column(price_mask.sum(), exclude=(ean_col, name_col))
+    if name_col is None:
+        name_col = _best_column(text_mask.sum(), exclude=(ean_col, price_col))
     return ean_col, name_col, price_col
 # --- Koniec funkcji pomocniczych ---
 
@@ -208,102 +473,192 @@ def find_columns_by_content(df, start_row):
 # --- POCZATEK: NOWA funkcja scrapujaca (SeleniumBase) ---
 logger = logging.getLogger(__name__) # get logger
 
+ALLEGRO_LISTING_URL = "https://allegro.pl/listing"
+LISTING_STATE_BOX_ID = "EHg7vYMJTQ275owpOcr4Lg=="
+
+
+def _parse_listing_state(data: dict) -> tuple:
+    """Z JSON-a listingu (``__listing_StoreState``) wyciaga (sold, minPrice)."""
+    sold = None
+    price = None
+    minPrice = None
+
+    for item in data["__listing_StoreState"]["items"]["elements"]:
+        try:
+            sold_value = item['productPopularity']['label'].split(' ')[0]
+            sold = int(sold_value)
+        except Exception:
+            pass
+
+        try:
+            price_value = item['price']['mainPrice']['amount']
+            price = float(price_value)
+        except Exception:
+            pass
+
+        if minPrice is None or (price is not None and price < minPrice):
+            minPrice = price
+
+    return sold, minPrice
+
+
+def _first_offer_url(data: dict) -> Optional[str]:
+    """URL pierwszej oferty z listingu (do walidacji EAN na stronie produktu)."""
+    for item in data["__listing_StoreState"]["items"]["elements"]:
+        if isinstance(item, dict) and item.get("url"):
+            return item["url"]
+    return None
+
+
+_GTIN_JS = "return document.querySelector('meta[itemprop=\"gtin\"]')?.content || null;"
+
+
+def _listing_result(ean: str, sold, minPrice, pein, source: str) -> dict:
+    """Buduje wynik scrapowania; EAN niezgodny z ``gtin`` strony = not_found."""
+    notFound = False
+    if (minPrice is None and sold is None):
+        notFound = True
+    elif pein is not None and pein != ean:
+        logger.warning(f"[{source}] EAN mismatch! Searched for {ean}, but found {pein}")
+        notFound = True
+
+    if notFound:
+        sold = None
+        minPrice = None
+
+    return {
+        "ean": ean,
+        "allegro_lowest_price": minPrice,
+        "sold_count": sold,
+        "last_checked_at": datetime.now(timezone.utc).isoformat(),
+        "source": source,
+        "not_found": notFound
+    }
+
+
+# Jedna przegladarka na proces workera, wspoldzielona przez kolejne EAN-y.
+# Tworzona leniwie (worker kolejki "celery" nigdy jej nie uruchamia).
+_DRIVER = None
+_DRIVER_USES = 0
+_CONSENT_ACCEPTED = False
+
+
+def _get_driver():
+    """Zwraca przegladarke procesu; restartuje ja po SCRAPER_DRIVER_MAX_USES uzyciach."""
+    global _DRIVER, _DRIVER_USES
+
+    if _DRIVER is not None and _DRIVER_USES >= SCRAPER_DRIVER_MAX_USES:
+        logger.info(f"[SeleniumBase] recycling driver after {_DRIVER_USES} uses")
+        _quit_driver()
+
+    if _DRIVER is None:
+        # Wymuszamy tryb headed jak w oryginalnym skrypcie (okno widoczne)
+        _DRIVER = Driver(uc=True, headed=True)
+        _DRIVER.maximize_window()
+        _DRIVER_USES = 0
+
+    _DRIVER_USES += 1
+    return _DRIVER
+
+
+def _quit_driver() -> None:
+    global _DRIVER, _CONSENT_ACCEPTED
+
+    driver, _DRIVER = _DRIVER, None
+    _CONSENT_ACCEPTED = False
+    if driver is not None:
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"[SeleniumBase] driver.quit() failed: {e}")
+
+
+@worker_process_shutdown.connect
+def shutdown_driver(**kwargs):
+    _quit_driver()
+    _shutdown_http_pool()
+
+
+@worker_process_init.connect
+def register_driver_cleanup(**kwargs):
+    # child recyklowany przez --max-memory-per-child moze nie dostac
+    # worker_process_shutdown - atexit zamyka wtedy Chrome i pule HTTP
+    # (oba zamkniecia sa idempotentne)
+    atexit.register(_quit_driver)
+    atexit.register(_shutdown_http_pool)
+
+
 def fetch_with_seleniumbase(ean: str) -> dict:
     """
     Scrapes Allegro for a single EAN (parsed from the uploaded input file)
     using the SeleniumBase snippet provided by the user.
+
+    The browser is reused between calls in the same worker process and
+    restarted after a crash or every ``SCRAPER_DRIVER_MAX_USES`` EANs.
     """
+    global _CONSENT_ACCEPTED
+
     logger.info(f"[SeleniumBase] running for EAN: {ean}")
 
-    driver = None
     try:
-        # Wymuszamy tryb headed jak w oryginalnym skrypcie (okno widoczne)
-        driver = Driver(uc=True, headed=True)
-        driver.maximize_window()
-        driver.get(f'https://allegro.pl/listing?string={ean}')
+        driver = _get_driver()
+        driver.get(f'{ALLEGRO_LISTING_URL}?string={ean}')
 
         # Baner RODO potrafi blokować dopóki nie klikniemy zgody
-        try:
-            consent_btn = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[data-role="accept-consent"]'))
-            )
-            consent_btn.click()
-        except Exception:
-            pass
+        # (zgoda zostaje w ciasteczkach przegladarki, wiec tylko raz)
+        if not _CONSENT_ACCEPTED:
+            try:
+                consent_btn = WebDriverWait(driver, 10).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[data-role="accept-consent"]'))
+                )
+                consent_btn.click()
+                _CONSENT_ACCEPTED = True
+            except Exception:
+                pass
 
         script_tag = WebDriverWait(driver, 40).until(
             EC.presence_of_element_located(
-                (By.CSS_SELECTOR, 'script[data-serialize-box-id="EHg7vYMJTQ275owpOcr4Lg=="]')
+                (By.CSS_SELECTOR, f'script[data-serialize-box-id="{LISTING_STATE_BOX_ID}"]')
             )
         )
         strData = script_tag.get_attribute("innerHTML")
-        data = json.loads(strData)
-
-        sold = None
-        price = None
-        minPrice = None
-
-        for item in data["__listing_StoreState"]["items"]["elements"]:
-            try:
-                sold_value = item['productPopularity']['label'].split(' ')[0]
-                sold = int(sold_value)
-            except Exception:
-                pass
-
-            try:
-                price_value = item['price']['mainPrice']['amount']
-                price = float(price_value)
-            except Exception:
-                pass
-
-            if minPrice is None or (price is not None and price < minPrice):
-                minPrice = price
+        data = orjson.loads(strData)
+        sold, minPrice = _parse_listing_state(data)
 
         pein = None
         try:
-            title = driver.find_element(By.CSS_SELECTOR, '.mgn2_14.m9qz_yp')
-            try:
-                title.click()
-            except Exception:
-                pass
+            # URL oferty bierzemy z JSON-a listingu - bez klikania i sleep();
+            # meta gtin jest w HTML-u strony, wiec czytamy ja jednym execute_script
+            product_url = _first_offer_url(data)
+            if product_url:
+                driver.get(product_url)
+                pein = driver.execute_script(_GTIN_JS)
+            else:
+                title = driver.find_element(By.CSS_SELECTOR, '.mgn2_14.m9qz_yp')
+                try:
+                    title.click()
+                except Exception:
+                    pass
 
-            time.sleep(2)
+                time.sleep(2)
 
-            try:
-                href = driver.find_element(By.CLASS_NAME, '_1e32a_zIS-q').get_attribute('href')
-                if href:
-                    driver.get(href)
-            except Exception:
-                pass
+                try:
+                    href = driver.find_element(By.CLASS_NAME, '_1e32a_zIS-q').get_attribute('href')
+                    if href:
+                        driver.get(href)
+                except Exception:
+                    pass
 
-            script_tag = WebDriverWait(driver, 40).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, 'meta[itemprop="gtin"]')
+                script_tag = WebDriverWait(driver, 40).until(
+                    EC.presence_of_element_located(
+                        (By.CSS_SELECTOR, 'meta[itemprop="gtin"]')
+                    )
                 )
-            )
-            pein = script_tag.get_attribute("content")
+                pein = script_tag.get_attribute("content")
         except Exception as e:
             logger.warning(f"[SeleniumBase] EAN validation step failed for {ean}: {e}")
 
-        notFound = False
-        if (minPrice is None and sold is None):
-            notFound = True
-        elif pein is not None and pein != ean:
-            logger.warning(f"[SeleniumBase] EAN mismatch! Searched for {ean}, but found {pein}")
-            notFound = True
-
-        if notFound:
-            sold = None
-            minPrice = None
-
-        detail = {
-            "ean": ean,
-            "allegro_lowest_price": minPrice,
-            "sold_count": sold,
-            "last_checked_at": datetime.now(timezone.utc).isoformat(),
-            "source": "scrape",
-            "not_found": notFound
-        }
+        detail = _listing_result(ean, sold, minPrice, pein, "scrape")
         logger.info(f"[SeleniumBase] result for EAN {ean}: {detail}")
         return detail
 
@@ -312,272 +667,792 @@ def fetch_with_seleniumbase(ean: str) -> dict:
         return {"ean": ean, "source": "selenium_timeout", "not_found": True, "error": "TimeoutException", "last_checked_at": datetime.now(timezone.utc).isoformat()}
     except Exception as e:
         logger.error(f"[SeleniumBase] Critical subprocess error for EAN {ean}: {e}")
+        # przegladarka mogla sie wysypac - nastepny EAN dostanie nowa
+        _quit_driver()
         return {"ean": ean, "source": "selenium_error", "not_found": True, "error": str(e), "last_checked_at": datetime.now(timezone.utc).isoformat()}
-    finally:
-        if driver:
-            driver.quit()
 # --- KONIEC: NOWA funkcja scrapujaca ---
 
 
-@celery.task(bind=True, acks_late=True, max_retries=3)
+# --- Szybka sciezka HTTP (bez przegladarki) ---
+# Listing renderowany jest po stronie serwera: JSON ze stanem listingu i meta gtin
+# sa w HTML-u, wiec zwykly GET wystarcza. Przy blokadzie (403/429/CAPTCHA)
+# wracamy do SeleniumBase.
+_LISTING_STATE_RE = re.compile(
+    r'<script[^>]*data-serialize-box-id="%s"[^>]*>(.*?)</script>' % re.escape(LISTING_STATE_BOX_ID),
+    re.S,
+)
+_GTIN_RE = re.compile(r'<meta[^>]*itemprop="gtin"[^>]*content="([^"]*)"')
+_BLOCK_MARKERS = ("captcha-delivery.com", "geo.captcha-delivery")
+_HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "pl-PL,pl;q=0.9",
+}
+
+# requests.Session nie jest gwarantowanie thread-safe - osobna sesja na watek
+_HTTP_LOCAL = threading.local()
+
+# Jedna pula watkow HTTP na proces workera - watki (a z nimi sesje keep-alive
+# z _HTTP_LOCAL) przezywaja kolejne paczki fetch_allegro_batch
+_HTTP_POOL: Optional[ThreadPoolExecutor] = None
+_HTTP_POOL_LOCK = threading.Lock()
+
+
+def _get_http_pool() -> ThreadPoolExecutor:
+    """Pula tworzona leniwie - dopiero w procesie potomnym, po forku."""
+    global _HTTP_POOL
+    with _HTTP_POOL_LOCK:
+        if _HTTP_POOL is None:
+            _HTTP_POOL = ThreadPoolExecutor(
+                max_workers=SCRAPER_HTTP_CONCURRENCY, thread_name_prefix="allegro-http"
+            )
+        return _HTTP_POOL
+
+
+def _shutdown_http_pool() -> None:
+    global _HTTP_POOL
+    with _HTTP_POOL_LOCK:
+        pool, _HTTP_POOL = _HTTP_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _proxy_url() -> Optional[str]:
+    """PROXY_URL (host:port lub pelny URL) uzupelniony o dane logowania z env."""
+    if not PROXY_URL:
+        return None
+    url = PROXY_URL if "://" in PROXY_URL else f"http://{PROXY_URL}"
+    if PROXY_USERNAME and "@" not in url:
+        scheme, rest = url.split("://", 1)
+        url = f"{scheme}://{quote(PROXY_USERNAME, safe='')}:{quote(PROXY_PASSWORD or '', safe='')}@{rest}"
+    return url
+
+
+def _get_http_session() -> requests.Session:
+    """Sesja HTTP (keep-alive, proxy) na watek procesu workera."""
+    session = getattr(_HTTP_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(_HTTP_HEADERS)
+        # keep-alive do allegro.pl (listing + strona oferty); ponowienia robi
+        # fallback do SeleniumBase, nie urllib3
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        proxy = _proxy_url()
+        if proxy:
+            session.proxies.update({"http": proxy, "https": proxy})
+        _HTTP_LOCAL.session = session
+    return session
+
+
+def _is_blocked(resp) -> bool:
+    if resp.status_code in (403, 429):
+        return True
+    return any(marker in resp.text for marker in _BLOCK_MARKERS)
+
+
+def fetch_with_http(ean: str) -> Optional[dict]:
+    """
+    Scrapes the Allegro listing for a single EAN with plain HTTP requests.
+
+    Returns ``None`` when the page is blocked or does not contain the
+    expected payload, so the caller can fall back to SeleniumBase.
+    """
+    session = _get_http_session()
+    try:
+        resp = session.get(ALLEGRO_LISTING_URL, params={"string": ean}, timeout=SCRAPER_HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"[HTTP] request failed for EAN {ean}: {e}")
+        return None
+    if _is_blocked(resp) or resp.status_code != 200:
+        logger.info(f"[HTTP] listing blocked/unavailable for EAN {ean} (HTTP {resp.status_code})")
+        return None
+
+    match = _LISTING_STATE_RE.search(resp.text)
+    if not match:
+        logger.info(f"[HTTP] listing state not found for EAN {ean}")
+        return None
+    try:
+        data = orjson.loads(match.group(1))
+        sold, minPrice = _parse_listing_state(data)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.info(f"[HTTP] unexpected listing payload for EAN {ean}: {e}")
+        return None
+
+    # Walidacja EAN: strona pierwszej oferty z listingu i jej <meta itemprop="gtin">
+    pein = None
+    product_url = _first_offer_url(data)
+    if product_url:
+        try:
+            product_resp = session.get(product_url, timeout=SCRAPER_HTTP_TIMEOUT)
+            if product_resp.status_code == 200 and not _is_blocked(product_resp):
+                gtin = _GTIN_RE.search(product_resp.text)
+                pein = gtin.group(1) if gtin else None
+        except requests.RequestException as e:
+            logger.warning(f"[HTTP] EAN validation step failed for {ean}: {e}")
+
+    detail = _listing_result(ean, sold, minPrice, pein, "http_scrape")
+    logger.info(f"[HTTP] result for EAN {ean}: {detail}")
+    return detail
+
+
+def fetch_allegro_listing(ean: str) -> dict:
+    """Najpierw tani GET, przegladarka tylko gdy Allegro zablokuje zapytanie."""
+    if SCRAPER_HTTP_ENABLED:
+        detail = fetch_with_http(ean)
+        if detail is not None:
+            return detail
+    return fetch_with_seleniumbase(ean)
+
+
+def detect_import_layout(df_head: pd.DataFrame) -> tuple:
+    """
+    Na probce z poczatku pliku (bez naglowka) wykrywa wiersz naglowka i pozycje
+    kolumn EAN / nazwa / cena. Zwraca (pierwszy wiersz danych, ean, name, price).
+    """
+    header_row_index = find_header_row(df_head.head(15))
+    data_start_row = header_row_index + 1
+
+    ean_keys = ['ean', 'barcode', 'kod', 'symbol']
+    name_keys = ['name', 'nazwa', 'title', 'tytuł', 'opis', 'description']
+    price_keys = ['price', 'cena', 'cost', 'koszt', 'wartość', 'netto']
+
+    names = _header_names(df_head.iloc[header_row_index]) if len(df_head) else []
+    ean_col = next((i for i, c in enumerate(names) if any(key in c for key in ean_keys)), None)
+    name_col = next((i for i, c in enumerate(names) if any(key in c for key in name_keys)), None)
+    price_col = next((i for i, c in enumerate(names) if any(key in c for key in price_keys)), None)
+
+    if None in (ean_col, name_col, price_col):
+        ean_col, name_col, price_col = find_columns_by_content(df_head, data_start_row)
+
+    missing_cols = []
+    if ean_col is None: missing_cols.append("EAN/Barcode/Kod")
+    if name_col is None: missing_cols.append("Nazwa/Name/Title")
+    if price_col is None: missing_cols.append("Cena/Price/Koszt")
+    
+    if missing_cols:
+         raise ValueError(f"Nie znaleziono wymaganych kolumn zawierających słowa: {', '.join(missing_cols)}")
+
+    return data_start_row, ean_col, name_col, price_col
+
+
+def _text_column(col: pd.Series) -> pd.Series:
+    """Kolumna jako napisy bez brakow; kolumna juz w _TEXT_DTYPE nie jest konwertowana."""
+    return col.fillna("").astype(_TEXT_DTYPE)
+
+
+def normalize_import_rows(df: pd.DataFrame, ean_col: int, name_col: int, price_col: int) -> pd.DataFrame:
+    """
+    Normalizacja i filtr na calych kolumnach (bez iterrows); nazwy obrabiamy
+    dopiero po odfiltrowaniu wierszy bez EAN/ceny.
+    """
+    ean_norm = normalize_ean_series(_text_column(df.iloc[:, ean_col]))
+    price_norm = parse_price_series(_text_column(df.iloc[:, price_col]))
+    mask = ean_norm.notna() & price_norm.notna() & (price_norm > 0)
+    return pd.DataFrame({
+        "ean_norm": ean_norm[mask],
+        "name_norm": _text_column(df.iloc[:, name_col][mask]).str.strip(),
+        "price_norm": price_norm[mask],
+    })
+
+
+def _fresh_cache_map(db: Session, eans: list, ttl_limit) -> dict:
+    """
+    Swieze wpisy cache dla EAN-ow sprawdzane hurtowo w SQL - trafienia dostaja
+    status od razu i nie trafiaja do kolejki scrapera.
+    """
+    cache_map = {}
+    for batch in chunked(eans, 1000):
+        cache_map.update(
+            (row.ean, row)
+            for row in db.query(
+                models.AllegroCache.ean,
+                models.AllegroCache.not_found,
+                models.AllegroCache.fetched_at,
+            ).filter(
+                models.AllegroCache.ean.in_(batch),
+                models.AllegroCache.fetched_at > ttl_limit,
+                or_(
+                    models.AllegroCache.source.is_(None),
+                    models.AllegroCache.source.notin_(INVALID_CACHE_SOURCES),
+                ),
+            )
+        )
+    return cache_map
+
+
+def _product_records(df_valid: pd.DataFrame, cache_map: dict, import_job_id: int, currency: str) -> list:
+    """
+    Status/notatki z cache i kolumny stale dokladane wektorowo, rekordy
+    do INSERT-a/COPY jednym to_dict('records').
+    """
+    cache_status = {}
+    cache_notes = {}
+    for ean, cache in cache_map.items():
+        if cache.not_found:
+            cache_status[ean] = "not_found"
+            cache_notes[ean] = f"Cached not_found @ {cache.fetched_at.date()}"
+        else:
+            cache_status[ean] = "done"
+            cache_notes[ean] = f"Cached data @ {cache.fetched_at.date()}"
+    notes = df_valid["ean_norm"].map(cache_notes)
+    return (
+        df_valid.rename(columns={"ean_norm": "ean", "name_norm": "name", "price_norm": "purchase_price"})
+        .assign(
+            import_job_id=import_job_id,
+            currency=currency,
+            status=df_valid["ean_norm"].map(cache_status).fillna("queued"),
+            notes=notes.astype(object).where(notes.notna(), None),
+        )
+        .to_dict("records")
+    )
+
+
+def insert_product_inputs(db: Session, import_job_id: int, records: list) -> list:
+    """
+    Wstawia rekordy ProductInput hurtowo i zwraca (id, ean) tych w statusie
+    "queued" - do zakolejkowania scrapera.
+    """
+    dialect = db.get_bind().dialect
+    if dialect.name == "postgresql" and len(records) > PRODUCT_COPY_THRESHOLD:
+        last_id = _last_product_id(db, import_job_id)
+        _copy_product_inputs(db, records)
+        return _queued_product_ids(db, import_job_id, last_id)
+
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        # Jeden INSERT ... RETURNING (executemany / insertmanyvalues) zamiast N obiektow ORM
+        ids = db.execute(
+            insert(models.ProductInput).returning(
+                models.ProductInput.id, sort_by_parameter_order=True
+            ),
+            records,
+        ).scalars().all()
+        return [
+            (product_id, r["ean"])
+            for product_id, r in zip(ids, records)
+            if r["status"] == "queued"
+        ]
+
+    # dialekty bez RETURNING przy executemany: INSERT hurtem + jeden SELECT po id
+    last_id = _last_product_id(db, import_job_id)
+    db.execute(insert(models.ProductInput), records)
+    return _queued_product_ids(db, import_job_id, last_id)
+
+
+def unique_ean_payloads(task_payloads) -> list:
+    """
+    Jeden (product_id, ean) na EAN - pierwszy wiersz z danym EAN-em; wynik
+    scrapowania trafia potem do wszystkich jego duplikatow w jobie
+    (_mark_duplicates).
+    """
+    first_ids = {}
+    for product_id, ean in task_payloads:
+        first_ids.setdefault(ean, product_id)
+    return [(product_id, ean) for ean, product_id in first_ids.items()]
+
+
+def _discard_products(db: Session, import_job_id: int) -> None:
+    """Usuwa ProductInput joba (bez commita); zakolejkowane juz zadania nie znajda wierszy."""
+    db.query(models.ProductInput).filter(
+        models.ProductInput.import_job_id == import_job_id
+    ).delete(synchronize_session=False)
+
+
+def _last_product_id(db: Session, import_job_id: int) -> int:
+    return (
+        db.query(func.max(models.ProductInput.id))
+        .filter(models.ProductInput.import_job_id == import_job_id)
+        .scalar() or 0
+    )
+
+
+def _queued_product_ids(db: Session, import_job_id: int, after_id: int = 0) -> list:
+    """(id, ean) produktow "queued" wstawionych po ``after_id`` (kolejne paczki importu)."""
+    return [
+        (row.id, row.ean)
+        for row in db.query(models.ProductInput.id, models.ProductInput.ean)
+        .filter(
+            models.ProductInput.import_job_id == import_job_id,
+            models.ProductInput.status == "queued",
+            models.ProductInput.id > after_id,
+        )
+        .order_by(models.ProductInput.id)
+    ]
+
+
+_PRODUCT_COPY_COLUMNS = ("import_job_id", "ean", "name", "purchase_price", "currency", "status", "notes")
+
+
+def _copy_product_inputs(db: Session, records: list) -> None:
+    """
+    COPY ... FROM STDIN dla duzych importow (Postgres) - omija parsowanie
+    i planowanie INSERT-a per wiersz. Dziala w transakcji sesji.
+    """
+    columns = ", ".join(_PRODUCT_COPY_COLUMNS)
+    rows = ([r[c] for c in _PRODUCT_COPY_COLUMNS] for r in records)
+    dbapi_conn = db.connection().connection.driver_connection
+    with dbapi_conn.cursor() as cursor:
+        if hasattr(cursor, "copy"):
+            # psycopg 3 - wiersze binarnie przez protokol COPY, None -> NULL
+            with cursor.copy(f"COPY product_inputs ({columns}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            # psycopg2 - CSV w pamieci; puste pola tekstowe to '' (a nie NULL),
+            # wyjatek to notes, gdzie puste = NULL
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            buf.seek(0)
+            cursor.copy_expert(
+                f"COPY product_inputs ({columns}) FROM STDIN WITH (FORMAT csv, "
+                "FORCE_NOT_NULL (ean, name, currency, status))",
+                buf,
+            )
+
+
+_IMPORT_ATTEMPTS_TTL = 24 * 3600
+
+
+def _import_delivery(import_job_id: int) -> int:
+    """Ktore to dostarczenie parse_import_file dla joba (licznik w Redis; 1 bez Redisa)."""
+    key = f"import_attempts:{import_job_id}"
+    try:
+        attempt = _get_redis().incr(key)
+        _get_redis().expire(key, _IMPORT_ATTEMPTS_TTL)
+        return attempt
+    except Exception as e:
+        logger.warning(f"[parse] delivery counter unavailable for job {import_job_id}: {e}")
+        return 1
+
+
+def _clear_import_deliveries(import_job_id: int) -> None:
+    try:
+        _get_redis().delete(f"import_attempts:{import_job_id}")
+    except Exception:
+        pass
+
+
+# acks_late + reject_on_worker_lost: zabity worker oddaje zadanie do kolejki, ale
+# licznik dostarczen nie pozwala, by plik zabijajacy workera wracal bez konca
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=3)
 def parse_import_file(self, import_job_id: int, filepath: str):
     """
     Krok 1: Parsuje wgrany plik, tworzy ProductInput i kolejkuje zadania fetch_allegro_data
     """
-    db = SessionLocal()
+    db = TaskSession()
     try:
         job = db.query(models.ImportJob).filter(models.ImportJob.id == import_job_id).first()
         if not job:
             return 
+        if _import_delivery(import_job_id) > IMPORT_MAX_DELIVERIES:
+            logger.error(f"[parse] job {import_job_id} killed the worker {IMPORT_MAX_DELIVERIES} times, giving up")
+            _discard_products(db, import_job_id)
+            update_job_error(db, job, "Import przerwany: plik wielokrotnie przerwal prace workera (np. za duzy plik).")
+            db.commit()
+            _clear_import_deliveries(import_job_id)
+            return
         job.status = "processing"
         job.notes = None
         db.commit()
 
         try:
-            df = pd.read_excel(filepath, header=None, dtype=str) if filepath.lower().endswith(".xlsx") else pd.read_csv(filepath, header=None, dtype=str)
+            df_head, read_chunks = read_table_chunks(filepath)
         except Exception as e:
             raise ValueError(f"Nie można otworzyć pliku: {e}")
-            
-        header_row_index = find_header_row(df.head(15)) 
-        data_start_row = header_row_index + 1
 
-        try:
-            df = pd.read_excel(filepath, header=header_row_index, dtype=str) if filepath.lower().endswith(".xlsx") else pd.read_csv(filepath, header=header_row_index, dtype=str)
-        except Exception:
-            df = pd.read_excel(filepath, header=None, dtype=str) if filepath.lower().endswith(".xlsx") else pd.read_csv(filepath, header=None, dtype=str)
-            data_start_row = 0 
-
-        df.columns = [str(c).lower() for c in df.columns]
-
-        ean_keys = ['ean', 'barcode', 'kod', 'symbol']
-        name_keys = ['name', 'nazwa', 'title', 'tytuł', 'opis', 'description']
-        price_keys = ['price', 'cena', 'cost', 'koszt', 'wartość', 'netto']
-
-        ean_col = next((c for c in df.columns if any(key in str(c) for key in ean_keys)), None)
-        name_col = next((c for c in df.columns if any(key in str(c) for key in name_keys)), None)
-        price_col = next((c for c in df.columns if any(key in str(c) for key in price_keys)), None)
-
-        if not all([ean_col, name_col, price_col]):
-            df_no_header = pd.read_excel(filepath, header=None, dtype=str) if filepath.lower().endswith(".xlsx") else pd.read_csv(filepath, header=None, dtype=str)
-            
-            c_ean, c_name, c_price = find_columns_by_content(df_no_header, data_start_row)
-            
-            df = df_no_header 
-            ean_col = c_ean
-            name_col = c_name
-            price_col = c_price
-            
-            df = df.iloc[data_start_row:].copy() 
-        
-        missing_cols = []
-        if ean_col is None: missing_cols.append("EAN/Barcode/Kod")
-        if name_col is None: missing_cols.append("Nazwa/Name/Title")
-        if price_col is None: missing_cols.append("Cena/Price/Koszt")
-        
-        if missing_cols:
-             raise ValueError(f"Nie znaleziono wymaganych kolumn zawierających słowa: {', '.join(missing_cols)}")
-        
-        df.loc[:, "ean_norm"] = df[ean_col].astype(str).str.strip().str.lstrip('0')
-        df.loc[:, "name_norm"] = df[name_col].astype(str).str.strip()
-        df.loc[:, "price_norm"] = pd.to_numeric(
-            df[price_col].astype(str).str.replace(',', '.').str.replace(r'[^\d\.]', '', regex=True), 
-            errors='coerce'
-        )
+        data_start_row, ean_col, name_col, price_col = detect_import_layout(df_head)
+        # z pliku czytamy tylko wykryte kolumny; w ramkach maja numery 0..n-1
+        usecols = sorted({ean_col, name_col, price_col})
+        ean_pos, name_pos, price_pos = (usecols.index(c) for c in (ean_col, name_col, price_col))
 
         cache_ttl_days = _get_cache_ttl_days()
-        # Prefetch cache dla EAN?w z pliku, aby nie kolejkowa? ?wie?ych danych
-        eans_in_file = set(df["ean_norm"].dropna().astype(str).str.strip())
-        cache_rows = []
-        if eans_in_file:
-            cache_rows = (
-                db.query(models.AllegroCache)
-                .filter(models.AllegroCache.ean.in_(eans_in_file))
-                .all()
-            )
-        cache_map = {c.ean: c for c in cache_rows}
-        ttl_limit = datetime.utcnow() - timedelta(days=cache_ttl_days)
-        INVALID_CACHE_SOURCES = ['failed', 'error', 'ban_detected', 'captcha_detected', 'antibot_error', 'selenium_error', 'selenium_timeout']
-
-        products_to_enqueue = []
-        for _, row in df.iterrows():
-            if not row["ean_norm"] or pd.isna(row["price_norm"]) or row["price_norm"] <= 0:
-                continue 
-
-            p = models.ProductInput(
-                import_job_id=import_job_id,
-                ean=row["ean_norm"],
-                name=row["name_norm"],
-                purchase_price=row["price_norm"],
-                currency=job.meta.get("currency", "PLN"), 
-                status="pending",
-            )
-            db.add(p)
-
-            cache = cache_map.get(p.ean)
-            cache_fresh = (
-                cache
-                and cache.fetched_at
-                and cache.fetched_at > ttl_limit
-                and cache.source not in INVALID_CACHE_SOURCES
-            )
-            if cache_fresh:
-                if cache.not_found:
-                    p.status = "not_found"
-                    p.notes = f"Cached not_found @ {cache.fetched_at.date()}"
-                else:
-                    p.status = "done"
-                    p.notes = f"Cached data @ {cache.fetched_at.date()}"
-            else:
-                products_to_enqueue.append(p)
-
-        if not products_to_enqueue and not cache_rows:
-            raise ValueError("Nie znaleziono poprawnych wierszy w pliku (sprawd?, czy EAN i Ceny s? wype?nione).")
-
-        db.flush()
-
-        task_payloads: list[tuple[int, str]] = []
-        for p in products_to_enqueue:
-            p.status = "queued"
-            task_payloads.append((p.id, p.ean))
+        ttl_limit = datetime.now(timezone.utc) - timedelta(days=cache_ttl_days)
+        # meta jest nullable (JSON) - job bez meta dostaje domyslna walute
+        currency = (job.meta or {}).get("currency") or "PLN"
 
+        # ponowne dostarczenie (acks_late) po przerwanym imporcie nie dubluje wierszy
+        _discard_products(db, import_job_id)
         db.commit()
 
-        try:
-            for product_id, product_ean in task_payloads:
-                fetch_allegro_data.delay(product_id, product_ean)
-        except Exception as exc:
-            job.status = "error"
-            job.notes = f"Nie udało się zlecić zadań scrapera: {exc}"
+        # Kazda paczka wierszy: normalizacja -> cache -> INSERT/COPY -> commit ->
+        # kolejka scrapera, zanim czytamy nastepna - publikacja w brokerze i
+        # scrapowanie zachodza na parsowanie reszty pliku
+        _set_parsing(import_job_id, True)
+        total_records = 0
+        for chunk in read_chunks(usecols):
+            chunk = chunk[chunk.index >= data_start_row]
+            df_valid = normalize_import_rows(chunk, ean_pos, name_pos, price_pos)
+            if df_valid.empty:
+                continue
+            cache_map = _fresh_cache_map(db, df_valid["ean_norm"].unique().tolist(), ttl_limit)
+            records = _product_records(df_valid, cache_map, import_job_id, currency)
+            total_records += len(records)
+            task_payloads = insert_product_inputs(db, import_job_id, records)
             db.commit()
-            raise
 
+            try:
+                # powtarzajace sie EAN-y (ten sam SKU w kilku wierszach) scrapujemy raz
+                enqueue_fetch_tasks(unique_ean_payloads(task_payloads))
+            except Exception as exc:
+                raise RuntimeError(f"Nie udało się zlecić zadań scrapera: {exc}") from exc
+
+        if not total_records:
+            raise ValueError("Nie znaleziono poprawnych wierszy w pliku (sprawd?, czy EAN i Ceny s? wype?nione).")
+
+        _set_parsing(import_job_id, False)
         finalize_job_if_complete(import_job_id)
     except (ValueError, Exception) as e:
         db.rollback()
         job_to_update = db.query(models.ImportJob).filter(models.ImportJob.id == import_job_id).first()
         if job_to_update:
+            # wczesniejsze paczki sa juz zacommitowane - import jest wszystko albo nic
+            _discard_products(db, import_job_id)
             update_job_error(db, job_to_update, str(e))
             db.commit() 
         
         raise e 
     finally:
+        # tu dochodzimy tylko, gdy worker przezyl - licznik liczy same utracone dostarczenia
+        _clear_import_deliveries(import_job_id)
+        _set_parsing(import_job_id, False)
         db.close() 
 
 
-@celery.task(bind=True, acks_late=True, max_retries=3)
+def _mark_duplicates(db: Session, import_job_id: int, ean: str, status: str, notes: Optional[str]) -> None:
+    """
+    Przenosi status na pozostale aktywne wiersze joba z tym samym EAN-em
+    (kolejkowany jest tylko pierwszy z nich) - jeden UPDATE, bez commita.
+    """
+    db.execute(
+        update(models.ProductInput)
+        .where(
+            models.ProductInput.import_job_id == import_job_id,
+            models.ProductInput.ean == ean,
+            models.ProductInput.status.in_(ACTIVE_STATUSES),
+        )
+        .values(status=status, notes=notes)
+    )
+
+
+def _set_product_status(db: Session, p: models.ProductInput, status: str, notes: Optional[str]) -> None:
+    """
+    Ustawia status produktu i jego duplikatow EAN w obrebie joba. UPDATE z Core
+    zamiast flushu obiektu: wiersz usuniety w miedzyczasie (nieudany import)
+    daje UPDATE bez efektu, a nie StaleDataError przy commicie.
+    """
+    _set_status_by_id(db, p.id, p.import_job_id, p.ean, status, notes)
+
+
+def _set_status_by_id(
+    db: Session, product_id: int, import_job_id: int, ean: str, status: str, notes: Optional[str]
+) -> None:
+    """_set_product_status dla golych wartosci - bez odczytu obiektu wygaszonego po rollbacku."""
+    db.execute(
+        update(models.ProductInput)
+        .where(models.ProductInput.id == product_id)
+        .values(status=status, notes=notes)
+    )
+    _mark_duplicates(db, import_job_id, ean, status, notes)
+
+
+def _store_fetch_result(db: Session, p: models.ProductInput, ean: str, raw_result: dict) -> None:
+    """Zapisuje wynik scrapowania w AllegroCache i statusie ProductInput (bez commita)."""
+    try:
+        fetched_at_dt = datetime.fromisoformat(raw_result["last_checked_at"])
+    except (ValueError, TypeError, KeyError):
+        fetched_at_dt = datetime.now(timezone.utc) 
+
+    result = {
+        "lowest_price": raw_result.get("allegro_lowest_price"),
+        "sold_count": raw_result.get("sold_count"),
+        "source": raw_result.get("source", "seleniumbase_scrape"),
+        "fetched_at": fetched_at_dt,
+        "not_found": raw_result.get("not_found", False),
+        "error": raw_result.get("error"),
+        "alert_sent": False # seleniumbase has no alert system
+    }
+    
+    new_status = "done"
+    notes = "Fetched via " + result["source"]
+
+    if result.get("error"):
+        new_status = "error"
+        notes = f"seleniumbase error: {result['error']}"
+    elif result.get("not_found", False):
+        new_status = "not_found"
+        notes = "Product not found (seleniumbase)"
+
+    # ten blok jest na wypadek gdybysmy kiedys wrocili do scrapera
+    # ktory SAM wysyla alerty (na razie jest wylaczony)
+    if (
+        new_status == "error"
+        and result["source"] == "failed" 
+        and result.get("error")
+        and not result.get("alert_sent")
+    ):
+        send_scraper_alert(
+            "allegro_scrape_failed",
+            {"ean": ean, "error": result["error"]},
+        )
+
+    values = {
+        "ean": ean,
+        "lowest_price": result["lowest_price"],
+        "sold_count": result["sold_count"],
+        "source": result["source"],
+        "fetched_at": result["fetched_at"],
+        "not_found": result.get("not_found", False),
+    }
+    # INSERT ... ON CONFLICT (ean) DO UPDATE - bez wyscigu miedzy workerami
+    # scrapujacymi ten sam EAN (unikalny klucz uq_allegro_cache_ean)
+    upsert_stmt = crud.upsert_allegro_cache_stmt(db, values)
+    if upsert_stmt is not None:
+        db.execute(upsert_stmt)
+    else:
+        cache = db.query(models.AllegroCache).filter(models.AllegroCache.ean == ean).first()
+        if not cache:
+            cache = models.AllegroCache(ean=ean)
+            db.add(cache)
+        for key, value in values.items():
+            setattr(cache, key, value)
+
+    _set_product_status(db, p, new_status, notes)
+    _local_cache_put(ean, _CacheEntry(values["fetched_at"], values["not_found"], values["source"]))
+
+
+# Pola AllegroCache potrzebne do decyzji "z cache czy scrapowac"
+_CacheEntry = namedtuple("_CacheEntry", ("fetched_at", "not_found", "source"))
+
+# ean -> (wpis, monotonic wygasniecia); LRU, wspolne dla watkow procesu workera
+_LOCAL_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_LOCAL_CACHE_LOCK = threading.Lock()
+
+
+def _local_cache_put(ean: str, entry: Optional[_CacheEntry]) -> None:
+    """Zapamietuje wpis w procesie; None (albo wpis bledny) usuwa EAN z pamieci."""
+    if not SCRAPER_LOCAL_CACHE_SIZE:
+        return
+    with _LOCAL_CACHE_LOCK:
+        # zapamietujemy tylko wpisy, ktore moga byc trafieniem - brak/blad zawsze
+        # sprawdzamy w bazie, bo inny worker mogl juz ten EAN pobrac
+        if entry is None or entry.source in INVALID_CACHE_SOURCES:
+            _LOCAL_CACHE.pop(ean, None)
+            return
+        _LOCAL_CACHE[ean] = (entry, time.monotonic() + SCRAPER_LOCAL_CACHE_SECONDS)
+        _LOCAL_CACHE.move_to_end(ean)
+        while len(_LOCAL_CACHE) > SCRAPER_LOCAL_CACHE_SIZE:
+            _LOCAL_CACHE.popitem(last=False)
+
+
+def _cache_entries(db: Session, eans) -> dict:
+    """
+    Wpisy AllegroCache dla EAN-ow: najpierw pamiec procesu, reszta jednym
+    zapytaniem do bazy. O swiezosci wzgledem TTL nadal decyduje _cached_status.
+    """
+    entries, missing = {}, []
+    now = time.monotonic()
+    with _LOCAL_CACHE_LOCK:
+        for ean in eans:
+            hit = _LOCAL_CACHE.get(ean)
+            if hit is not None and hit[1] > now:
+                entries[ean] = hit[0]
+                _LOCAL_CACHE.move_to_end(ean)
+            else:
+                missing.append(ean)
+    if missing:
+        for row in db.query(
+            models.AllegroCache.ean,
+            models.AllegroCache.fetched_at,
+            models.AllegroCache.not_found,
+            models.AllegroCache.source,
+        ).filter(models.AllegroCache.ean.in_(missing)):
+            entry = _CacheEntry(row.fetched_at, row.not_found, row.source)
+            entries[row.ean] = entry
+            _local_cache_put(row.ean, entry)
+    return entries
+
+
+def _cached_status(cache, ttl_limit) -> Optional[tuple]:
+    """(status, notes) z cache, jesli wpis jest swiezy i poprawny; inaczej None."""
+    if not (cache and as_utc(cache.fetched_at) > ttl_limit and cache.source not in INVALID_CACHE_SOURCES):
+        return None
+    if cache.not_found:
+        return "not_found", f"Cached not_found @ {cache.fetched_at.date()}"
+    return "done", f"Cached data @ {cache.fetched_at.date()}"
+
+
+def _apply_cached(db: Session, p: models.ProductInput, cache, ttl_limit) -> bool:
+    """Ustawia status z cache, jesli wpis jest swiezy i poprawny."""
+    cached = _cached_status(cache, ttl_limit)
+    if cached is None:
+        return False
+    _set_product_status(db, p, *cached)
+    return True
+
+
+# padniety Chrome / zabity worker nie gubi zadania scrapera, tylko wraca ono do kolejki
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=3)
 def fetch_allegro_data(self, product_input_id: int, ean: str):
     """
     Krok 2: Pobiera dane z Allegro (z logiką cache)
     """
-    with SessionLocal() as db:
+    with TaskSession() as db:
         try:
-            # --- START FIX: Race condition read-after-write ---
-            p = None
-            for _ in range(3): # try 3 times
-                p = db.query(models.ProductInput).filter(models.ProductInput.id == product_input_id).first()
-                if p:
-                    break # found it
-                logger.warning(f"[fetch_allegro_data] ProductInput.id {product_input_id} not found (race condition?), retrying in 0.5s...")
-                time.sleep(0.5)
+            cache_ttl_days = _get_cache_ttl_days()
+            ttl_limit = datetime.now(timezone.utc) - timedelta(days=cache_ttl_days)
+            cache = _cache_entries(db, [ean]).get(ean)
 
+            # Trafienie w cache: jeden UPDATE ... RETURNING bez ladowania obiektu ORM
+            cached = _cached_status(cache, ttl_limit)
+            if cached is not None and db.get_bind().dialect.update_returning:
+                status, notes = cached
+                import_job_id = db.execute(
+                    update(models.ProductInput)
+                    .where(models.ProductInput.id == product_input_id)
+                    .values(status=status, notes=notes)
+                    .returning(models.ProductInput.import_job_id)
+                ).scalar()
+                if import_job_id is not None:
+                    _mark_duplicates(db, import_job_id, ean, status, notes)
+                    db.commit()
+                    schedule_finalize(import_job_id) 
+                    return 
+
+            # Zadania kolejkowane sa dopiero po commicie parsera, wiec brak wiersza
+            # to wyjatek - zamiast sleep() w slocie workera oddajemy zadanie Celery
+            p = db.get(models.ProductInput, product_input_id)
             if not p:
-                logger.error(f"[fetch_allegro_data] CRITICAL: ProductInput.id {product_input_id} not found after 3 retries. Task stopping.")
+                if self.request.retries < self.max_retries:
+                    logger.warning(f"[fetch_allegro_data] ProductInput.id {product_input_id} not found (race condition?), retrying in 1s...")
+                    raise self.retry(countdown=1)
+                logger.error(f"[fetch_allegro_data] CRITICAL: ProductInput.id {product_input_id} not found after {self.max_retries} retries. Task stopping.")
                 return 
-            # --- END FIX ---
 
-            cache_ttl_days = _get_cache_ttl_days()
             import_job_id = p.import_job_id
-            cache = db.query(models.AllegroCache).filter(models.AllegroCache.ean == ean).first()
-            ttl_limit = datetime.utcnow() - timedelta(days=cache_ttl_days)
-
-            if cache and cache.fetched_at > ttl_limit:
-                
-                # --- POPRAWKA LOGIKI CACHE (dla selenium) ---
-                INVALID_CACHE_SOURCES = ['failed', 'error', 'ban_detected', 'captcha_detected', 'antibot_error', 'selenium_error', 'selenium_timeout']
-                if cache.source not in INVALID_CACHE_SOURCES:
-                # --- KONIEC POPRAWKI LOGIKI CACHE ---
-                
-                    if cache.not_found:
-                        p.status = "not_found"
-                        p.notes = f"Cached not_found @ {cache.fetched_at.date()}"
-                    else:
-                        p.status = "done"
-                        p.notes = f"Cached data @ {cache.fetched_at.date()}"
-                    db.commit()
-                    finalize_job_if_complete(import_job_id) 
-                    return 
+            if _apply_cached(db, p, cache, ttl_limit):
+                db.commit()
+                schedule_finalize(import_job_id) 
+                return 
                 
-            p.status = "processing"
+            db.execute(
+                update(models.ProductInput)
+                .where(models.ProductInput.id == product_input_id)
+                .values(status="processing")
+            )
             db.commit()
 
-            # --- ZMIANA: Wywolanie SeleniumBase ---
-            raw_result = fetch_with_seleniumbase(ean)
-            
-            try:
-                fetched_at_dt = datetime.fromisoformat(raw_result["last_checked_at"])
-            except (ValueError, TypeError, KeyError):
-                fetched_at_dt = datetime.now(timezone.utc) 
-
-            result = {
-                "lowest_price": raw_result.get("allegro_lowest_price"),
-                "sold_count": raw_result.get("sold_count"),
-                "source": raw_result.get("source", "seleniumbase_scrape"),
-                "fetched_at": fetched_at_dt,
-                "not_found": raw_result.get("not_found", False),
-                "error": raw_result.get("error"),
-                "alert_sent": False # seleniumbase has no alert system
-            }
-            
-            new_status = "done"
-            notes = "Fetched via " + result["source"]
-
-            if result.get("error"):
-                new_status = "error"
-                notes = f"seleniumbase error: {result['error']}"
-            elif result.get("not_found", False):
-                new_status = "not_found"
-                notes = "Product not found (seleniumbase)"
-            
-            # --- KONIEC ZMIANY ---
-
-            # ten blok jest na wypadek gdybysmy kiedys wrocili do scrapera
-            # ktory SAM wysyla alerty (na razie jest wylaczony)
-            if (
-                new_status == "error"
-                and result["source"] == "failed" 
-                and result.get("error")
-                and not result.get("alert_sent")
-            ):
-                send_scraper_alert(
-                    "allegro_scrape_failed",
-                    {"ean": ean, "error": result["error"]},
-                )
-
-            if not cache:
-                cache = models.AllegroCache(ean=ean)
-                db.add(cache)
-            
-            cache.lowest_price = result["lowest_price"]
-            cache.sold_count = result["sold_count"]
-            cache.source = result["source"]
-            cache.fetched_at = result["fetched_at"]
-            cache.not_found = result.get("not_found", False)
-
-            p.status = new_status
-            p.notes = notes
+            # --- ZMIANA: HTTP z fallbackiem do SeleniumBase ---
+            raw_result = fetch_allegro_listing(ean)
+            _store_fetch_result(db, p, ean, raw_result)
 
             db.commit()
-            finalize_job_if_complete(import_job_id) 
+            schedule_finalize(import_job_id) 
 
+        except Retry:
+            raise
         except Exception as e:
             db.rollback()
+            _local_cache_put(ean, None)  # zapis mogl zostac wycofany
             with SessionLocal() as error_db:
                 p_error = error_db.query(models.ProductInput).filter(models.ProductInput.id == product_input_id).first()
                 if p_error:
-                    p_error.status = "error"
-                    p_error.notes = f"Worker critical error: {e}"
+                    _set_product_status(error_db, p_error, "error", f"Worker critical error: {e}")
                     import_job_id = p_error.import_job_id
                     error_db.commit()
-                    finalize_job_if_complete(import_job_id) 
+                    schedule_finalize(import_job_id) 
             
             raise e
+
+
+def _fail_batch_products(payloads: list, notes: str) -> None:
+    """
+    Produkty paczki, ktore zostaly w aktywnym statusie (i ich duplikaty EAN),
+    dostaja "error" we wlasnej sesji - job moze sie wtedy zakonczyc.
+    """
+    ids = [product_id for product_id, _ in payloads]
+    with SessionLocal() as error_db:
+        stuck = error_db.execute(
+            select(models.ProductInput.import_job_id, models.ProductInput.ean)
+            .where(
+                models.ProductInput.id.in_(ids),
+                models.ProductInput.status.in_(ACTIVE_STATUSES),
+            )
+            .distinct()
+        ).all()
+        for import_job_id, ean in stuck:
+            _mark_duplicates(error_db, import_job_id, ean, "error", notes)
+        error_db.commit()
+    for import_job_id in {import_job_id for import_job_id, _ in stuck}:
+        schedule_finalize(import_job_id)
+
+
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def fetch_allegro_batch(self, payloads: list):
+    """
+    Krok 2 (wsadowo): jedna paczka (product_id, ean) - listingi pobierane
+    rownolegle zwyklym HTTP, przegladarka (jedna na proces) tylko dla EAN-ow,
+    ktore HTTP nie obsluzyl. Blad jednego produktu nie przerywa paczki.
+    """
+    with TaskSession() as db:
+        try:
+            ids = [product_id for product_id, _ in payloads]
+            products = {
+                p.id: p
+                for p in db.query(models.ProductInput).filter(models.ProductInput.id.in_(ids))
+            }
+            missing = [product_id for product_id in ids if product_id not in products]
+            if missing:
+                logger.error(f"[fetch_allegro_batch] ProductInput ids not found: {missing}")
+
+            caches = _cache_entries(db, {ean for _, ean in payloads})
+            ttl_limit = datetime.now(timezone.utc) - timedelta(days=_get_cache_ttl_days())
+            job_ids = {p.import_job_id for p in products.values()}
+
+            # klucze produktu jako zwykle wartosci - rollback wygasza obiekty ORM,
+            # a sciezka bledu nie moze ich odczytywac (wiersz mogl zostac usuniety)
+            to_fetch = []
+            for product_id, ean in payloads:
+                p = products.get(product_id)
+                if p is None or _apply_cached(db, p, caches.get(ean), ttl_limit):
+                    continue
+                to_fetch.append((p, product_id, p.import_job_id, ean))
+            if to_fetch:
+                db.execute(
+                    update(models.ProductInput)
+                    .where(models.ProductInput.id.in_([key[1] for key in to_fetch]))
+                    .values(status="processing")
+                )
+            db.commit()
+
+            http_results = [None] * len(to_fetch)
+            if SCRAPER_HTTP_ENABLED and to_fetch:
+                http_results = list(
+                    _get_http_pool().map(fetch_with_http, [ean for *_, ean in to_fetch])
+                )
+
+            for (p, product_id, import_job_id, ean), raw_result in zip(to_fetch, http_results):
+                try:
+                    if raw_result is None:
+                        raw_result = fetch_with_seleniumbase(ean)
+                    _store_fetch_result(db, p, ean, raw_result)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    _local_cache_put(ean, None)  # zapis mogl zostac wycofany
+                    logger.error(f"[fetch_allegro_batch] failed for EAN {ean}: {e}")
+                    _set_status_by_id(
+                        db, product_id, import_job_id, ean, "error", f"Worker critical error: {e}"
+                    )
+                    db.commit()
+
+            for import_job_id in job_ids:
+                schedule_finalize(import_job_id)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[fetch_allegro_batch] batch failed: {e}")
+            _fail_batch_products(payloads, f"Worker critical error: {e}")
+            raise
@@ -1,5 +1,17 @@
 # app/utils.py
-from typing import Optional
+import re
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, TypeVar
+
+import pandas as pd
+
+T = TypeVar("T")
+
+_NON_DIGIT_RE = re.compile(r"\D+")
+_NON_PRICE_RE = re.compile(r"[^\d.]+")
+# wszystko poza cyframi i separatorami dziesietnymi (waluta, spacje tysiecy, ...)
+_PRICE_JUNK_RE = re.compile(r"[^\d.,]+")
 
 def normalize_ean(raw_ean: Optional[str]) -> Optional[str]:
     """
@@ -7,10 +19,7 @@ def normalize_ean(raw_ean: Optional[str]) -> Optional[str]:
     """
     if raw_ean is None:
         return None
-    s = str(raw_ean).strip()
-    s = ''.join(ch for ch in s if ch.isdigit())
-    s = s.lstrip('0')
-    return s or None
+    return _NON_DIGIT_RE.sub('', str(raw_ean)).lstrip('0') or None
 
 def parse_price(value: Optional[str]) -> Optional[float]:
     """
@@ -22,12 +31,36 @@ def parse_price(value: Optional[str]) -> Optional[float]:
     try:
         return float(s)
     except ValueError:
-        s2 = ''.join(ch for ch in s if (ch.isdigit() or ch=='.'))
+        s2 = _NON_PRICE_RE.sub('', s)
         try:
             return float(s2) if s2 else None
-        except:
+        except ValueError:  # np. "1.2.3" po odfiltrowaniu
             return None
 
+def _as_text(s: pd.Series) -> pd.Series:
+    # kolumny string (tez string[pyarrow]) zostaja bez konwersji
+    return s if isinstance(s.dtype, pd.StringDtype) else s.astype("string")
+
+def normalize_ean_series(s: pd.Series) -> pd.Series:
+    """
+    normalize_ean dla calej kolumny naraz; puste wyniki jako <NA>.
+    Wzorce ida jako str - skompilowany Pattern wylacza kernel Arrow.
+    """
+    digits = _as_text(s).str.replace(_NON_DIGIT_RE.pattern, '', regex=True).str.lstrip('0')
+    return digits.replace('', pd.NA)
+
+def parse_price_series(s: pd.Series) -> pd.Series:
+    """
+    Ceny z calej kolumny (float64, NaN gdy brak): usuwa wszystko poza cyframi
+    i separatorami, przecinek -> kropka, np. "1 234,50 zl" -> 1234.5
+    """
+    cleaned = (
+        _as_text(s)
+        .str.replace(_PRICE_JUNK_RE.pattern, '', regex=True)
+        .str.replace(',', '.', regex=False)
+    )
+    return pd.to_numeric(cleaned, errors='coerce').astype("float64")
+
 def convert_currency(amount: float, rate: float) -> float:
     """
     Konwersja kwoty z waluty źródłowej na bazową
@@ -41,3 +74,24 @@ def is_profitable(purchase_price: float, lowest_price: float, multiplier: float
     if purchase_price is None or lowest_price is None:
         return False
     return lowest_price >= purchase_price * multiplier
+
+def chunked(items: Iterable[T], size: int = 1000) -> Iterator[List[T]]:
+    """
+    Dzieli iterowalna kolekcje na listy o dlugosci max `size`
+    (np. zeby nie przekroczyc limitu parametrow w `IN (...)`)
+    """
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Zwraca date ze strefa UTC; naiwne daty (np. z SQLite, ktore nie
+    przechowuje strefy) traktuje jako UTC
+    """
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
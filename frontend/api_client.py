@@ -0,0 +1,64 @@
+# Plik: frontend/api_client.py
+import json
+import os
+import time
+
+import requests
+
+API_BASE = "http://pilot_backend:8000/api"
+# adres backendu widziany z przegladarki (linki do pobrania raportu)
+PUBLIC_API_BASE = os.getenv("PUBLIC_API_BASE", "http://localhost:8000/api")
+
+# jedna sesja keep-alive na proces Streamlit - modul jest importowany raz,
+# wiec przetrwa ponowne uruchomienia skryptu
+session = requests.Session()
+
+def start_import(files, data):
+    return session.post(f"{API_BASE}/imports/start", files=files, data=data)
+
+def job_updates(job_id, cursor):
+    """
+    Kolejne stany joba (JSON jak z /status). Najpierw strumien SSE /events -
+    backend wysyla zdarzenie tylko przy zmianie; gdy endpointu nie ma (404)
+    albo strumien sie urwie, wracamy do odpytywania /imports/{id} co 3 s -
+    jedno zapytanie zwraca status i zmienione produkty (kursor since/etag
+    z `cursor`). Zwraca None, gdy statusu nie da sie pobrac.
+    """
+    try:
+        with session.get(f"{API_BASE}/imports/{job_id}/events", stream=True, timeout=(5, 30)) as resp:
+            if resp.status_code == 200:
+                for line in resp.iter_lines():
+                    if line.startswith(b"data: "):
+                        yield json.loads(line[6:])
+    except requests.exceptions.RequestException:
+        pass
+
+    while True:
+        snapshot_resp = fetch_job(job_id, since=cursor["since"], etag=cursor["etag"])
+        if snapshot_resp.status_code != 200:
+            yield None
+            return
+        yield snapshot_resp.json()
+        time.sleep(3)
+
+def _cursor_request(since, etag):
+    params = {"since": since} if since else None
+    headers = {"If-None-Match": etag} if etag else None
+    return params, headers
+
+def fetch_job(job_id, since=None, etag=None):
+    """GET /imports/{id} - status joba i produkty zmienione od `since` (null przy aktualnym `etag`)."""
+    params, headers = _cursor_request(since, etag)
+    return session.get(f"{API_BASE}/imports/{job_id}", params=params, headers=headers)
+
+def fetch_products(job_id, since=None, etag=None):
+    """GET /products - tylko zmiany od `since`; 304, gdy `etag` jest aktualny."""
+    params, headers = _cursor_request(since, etag)
+    return session.get(f"{API_BASE}/imports/{job_id}/products", params=params, headers=headers)
+
+def export_url(job_id, status=None, recommendation=None):
+    """Link do raportu CSV; filtry jak w tabeli UI (None = bez filtra)."""
+    params = {"status": status, "recommendation": recommendation}
+    return requests.Request(
+        "GET", f"{PUBLIC_API_BASE}/imports/{job_id}/export.csv", params=params
+    ).prepare().url
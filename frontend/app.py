@@ -2,119 +2,198 @@
 import streamlit as st
 import requests
 import pandas as pd
-import time
 import os
 import redis
-from io import BytesIO
 
-API_BASE = "http://pilot_backend:8000/api" 
+from api_client import API_BASE, export_url, fetch_products, job_updates, start_import
+from styles import recommendation_styles
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 CACHE_TTL_DAYS = int(os.getenv("CACHE_TTL_DAYS", "30"))
 
+ALL_OPTION = "wszystkie"
+RECOMMENDATION_OPTIONS = [
+    ALL_OPTION, "opłacalny", "nieopłacalny", "brak danych",
+    "brak na Allegro", "błąd pobierania", "w trakcie...",
+]
+STATUS_OPTIONS = [ALL_OPTION, "pending", "queued", "processing", "done", "not_found", "error"]
+
 def _get_redis():
     return redis.Redis.from_url(REDIS_URL)
 
-st.set_page_config(page_title="Import Allegro", layout="wide")
-st.title("Pilot: Import i analiza produktów")
+def _products_state(job_id):
+    """Tabela wynikow joba i kursor zmian (since/etag) trzymane w st.session_state."""
+    products = st.session_state.get("products")
+    if products is None or products["job"] != job_id:
+        products = {"job": job_id, "df": pd.DataFrame(), "since": None, "etag": None}
+        st.session_state["products"] = products
+    return products
 
-# ----------------------
-# Sterowanie liczb? okien scrapera
-# ----------------------
-with st.sidebar:
-    st.header("Scraper: liczba okien")
-    desired_default = 1
-    redis_client = None
-    try:
-        redis_client = _get_redis()
-        current = redis_client.get("scraper:desired_instances")
-        if current:
-            desired_default = max(1, min(20, int(current)))
-    except Exception as e:
-        st.warning(f"Redis niedostepny: {e}")
+def _refresh_products(products, job_data):
+    """
+    Pierwszy odczyt pobiera wszystko, kolejne tylko wiersze zmienione od
+    latest_ts (?since=), ktore nadpisuja swoje odpowiedniki po id. Odpowiedz
+    /imports/{id} (odpytywanie bez SSE) niesie produkty razem ze statusem;
+    przy zdarzeniu SSE pobieramy je osobno. Przy aktualnym ETagu backend nie
+    wysyla produktow. Zwraca (df, czy_zmieniona).
+    """
+    if "products" in job_data:
+        rows = job_data["products"]
+        etag, latest = job_data.get("products_etag"), job_data.get("latest_ts")
+    else:
+        resp = fetch_products(products["job"], since=products["since"], etag=products["etag"])
+        if resp.status_code != 200:
+            # 304 (bez zmian) albo blad - zostaje poprzednia tabela
+            return products["df"], False
+        rows = resp.json()
+        etag, latest = resp.headers.get("ETag"), resp.headers.get("X-Latest-Ts")
+    if rows is None:
+        return products["df"], False
 
-    desired = st.slider("Ile okien scrapera ma sie uruchomic?", 1, 20, desired_default)
-    if st.button("Zapisz liczbe okien"):
-        if redis_client:
-            try:
-                redis_client.set("scraper:desired_instances", desired)
-                st.success(f"Ustawiono {desired} okien scrapera.")
-            except Exception as e:
-                st.error(f"Nie udalo sie zapisac do Redis: {e}")
+    if rows:
+        delta = pd.DataFrame(rows).set_index("id", drop=False)
+        df = products["df"]
+        if df.empty:
+            df = delta
         else:
-            st.error("Brak polaczenia z Redis.")
+            df = pd.concat([df.drop(delta.index, errors="ignore"), delta]).sort_index()
+        products["df"] = df
+    products["since"] = latest or products["since"]
+    products["etag"] = etag
+    return products["df"], True
+
+def _selected(value):
+    return None if value == ALL_OPTION else value
 
-    ttl_default = CACHE_TTL_DAYS
-    if redis_client:
+def _filter_products(df, recommendation, status):
+    """Wiersze tabeli zgodne z wybranymi filtrami (None = bez filtra)."""
+    if recommendation and "recommendation" in df.columns:
+        df = df[df["recommendation"] == recommendation]
+    if status and "status" in df.columns:
+        df = df[df["status"] == status]
+    return df
+
+def _summary(df):
+    """Podsumowanie calej tabeli joba (niezaleznie od filtrow)."""
+    statuses = df["status"].value_counts()
+    recommendations = df["recommendation"].value_counts()
+    return (
+        f"Łącznie produktów: {len(df)}  \n"
+        f"Done: {statuses.get('done', 0)}, Pending: {statuses.get('pending', 0)}, "
+        f"Not Found: {statuses.get('not_found', 0)}, Error: {statuses.get('error', 0)}  \n"
+        f"Opłacalne: {recommendations.get('opłacalny', 0)}, "
+        f"Nieopłacalne: {recommendations.get('nieopłacalny', 0)}, "
+        f"Brak danych: {recommendations.get('brak danych', 0)}"
+    )
+
+# ----------------------
+# Sterowanie liczba okien scrapera
+# ----------------------
+def render_sidebar():
+    """Sterowanie liczba okien scrapera i TTL cache (Redis)."""
+    with st.sidebar:
+        st.header("Scraper: liczba okien")
+        desired_default = 1
+        redis_client = None
         try:
-            ttl_val_current = redis_client.get("scraper:cache_ttl_days")
-            if ttl_val_current:
-                ttl_default = max(1, min(365, int(ttl_val_current)))
-        except Exception:
-            pass
-    st.caption(f"Cache Allegro wazny {ttl_default} dni (starsze dane sa scrapowane ponownie).")
-
-    st.subheader("TTL cache (dni)")
-    ttl_val = st.slider("Ustaw waznosc cache (dni)", 1, 365, ttl_default)
-    if st.button("Zapisz TTL cache"):
+            redis_client = _get_redis()
+            current = redis_client.get("scraper:desired_instances")
+            if current:
+                desired_default = max(1, min(20, int(current)))
+        except Exception as e:
+            st.warning(f"Redis niedostepny: {e}")
+
+        desired = st.slider("Ile okien scrapera ma sie uruchomic?", 1, 20, desired_default)
+        if st.button("Zapisz liczbe okien"):
+            if redis_client:
+                try:
+                    redis_client.set("scraper:desired_instances", desired)
+                    st.success(f"Ustawiono {desired} okien scrapera.")
+                except Exception as e:
+                    st.error(f"Nie udalo sie zapisac do Redis: {e}")
+            else:
+                st.error("Brak polaczenia z Redis.")
+
+        ttl_default = CACHE_TTL_DAYS
         if redis_client:
             try:
-                redis_client.set("scraper:cache_ttl_days", ttl_val)
-                st.success(f"Cache TTL ustawiono na {ttl_val} dni.")
-            except Exception as e:
-                st.error(f"Nie udalo sie zapisac TTL do Redis: {e}")
-        else:
-            st.error("Brak polaczenia z Redis.")
+                ttl_val_current = redis_client.get("scraper:cache_ttl_days")
+                if ttl_val_current:
+                    ttl_default = max(1, min(365, int(ttl_val_current)))
+            except Exception:
+                pass
+        st.caption(f"Cache Allegro wazny {ttl_default} dni (starsze dane sa scrapowane ponownie).")
+
+        st.subheader("TTL cache (dni)")
+        ttl_val = st.slider("Ustaw waznosc cache (dni)", 1, 365, ttl_default)
+        if st.button("Zapisz TTL cache"):
+            if redis_client:
+                try:
+                    redis_client.set("scraper:cache_ttl_days", ttl_val)
+                    st.success(f"Cache TTL ustawiono na {ttl_val} dni.")
+                except Exception as e:
+                    st.error(f"Nie udalo sie zapisac TTL do Redis: {e}")
+            else:
+                st.error("Brak polaczenia z Redis.")
 
 # ----------------------
 # Upload pliku
 # ----------------------
-st.header("1. Wgraj plik Excel/CSV")
-uploaded_file = st.file_uploader("Wybierz plik .xlsx lub .csv", type=["xlsx", "csv"])
-category = st.text_input("Kategoria (np. perfumy)", "perfumy")
-currency = st.text_input("Waluta (np. PLN)", "PLN")
-
-if uploaded_file and st.button("Rozpocznij import"):
-    files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-    data = {"category": category, "currency": currency}
+def render_upload():
+    """Formularz importu - po utworzeniu joba zapisuje job_id w session_state."""
+    st.header("1. Wgraj plik Excel/CSV")
+    uploaded_file = st.file_uploader("Wybierz plik .xlsx lub .csv", type=["xlsx", "csv"])
+    category = st.text_input("Kategoria (np. perfumy)", "perfumy")
+    currency = st.text_input("Waluta (np. PLN)", "PLN")
+
+    if uploaded_file and st.button("Rozpocznij import"):
+        files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
+        data = {"category": category, "currency": currency}
     
-    with st.spinner("Wysyłanie pliku i tworzenie zadania..."):
-        try:
-            response = requests.post(f"{API_BASE}/imports/start", files=files, data=data)
-            if response.status_code == 200:
-                job_id = response.json()["job_id"]
-                st.success(f"Plik wgrany, job_id={job_id}")
-                st.session_state["job_id"] = job_id
-                st.session_state["stop_polling"] = False 
-                st.rerun() 
-            else:
-                st.error(f"Błąd przy wysyłaniu pliku: {response.status_code} - {response.text}")
-        except requests.exceptions.ConnectionError:
-            st.error(f"Błąd połączenia z backendem. Czy backend działa pod adresem {API_BASE}?")
-        except Exception as e:
-            st.error(f"Błąd krytyczny: {e}")
+        with st.spinner("Wysyłanie pliku i tworzenie zadania..."):
+            try:
+                response = start_import(files, data)
+                if response.status_code == 200:
+                    job_id = response.json()["job_id"]
+                    st.success(f"Plik wgrany, job_id={job_id}")
+                    st.session_state["job_id"] = job_id
+                    st.session_state["stop_polling"] = False 
+                    st.rerun() 
+                else:
+                    st.error(f"Błąd przy wysyłaniu pliku: {response.status_code} - {response.text}")
+            except requests.exceptions.ConnectionError:
+                st.error(f"Błąd połączenia z backendem. Czy backend działa pod adresem {API_BASE}?")
+            except Exception as e:
+                st.error(f"Błąd krytyczny: {e}")
 
 
 # ----------------------
 # Monitorowanie postępu i wyników
 # ----------------------
-if "job_id" in st.session_state and not st.session_state.get("stop_polling", False):
-    job_id = st.session_state["job_id"]
+def render_monitor(job_id):
+    """Postep joba i tabela wynikow, odswiezane przy kazdej zmianie statusu."""
     st.subheader(f"Monitorowanie zadania: {job_id}")
 
+    # zmiana filtra przeladowuje skrypt, wiec tabela i tak rysuje sie od nowa
+    filter_cols = st.columns(2)
+    selected_rekom = _selected(filter_cols[0].selectbox("Rekomendacja", RECOMMENDATION_OPTIONS))
+    selected_status = _selected(filter_cols[1].selectbox("Status", STATUS_OPTIONS))
+
     progress_bar = st.progress(0)
     status_text = st.empty()
+    summary_placeholder = st.empty()
     results_placeholder = st.empty()
+    table_shown = False
+    products = _products_state(job_id)
 
-    while True:
-        try:
-            # 1. Zawsze sprawdzaj status joba
-            status_resp = requests.get(f"{API_BASE}/imports/{job_id}/status")
-            if status_resp.status_code != 200:
+    try:
+        # 1. Kazda zmiana statusu joba (SSE albo odpytywanie w fallbacku)
+        for job_data in job_updates(job_id, products):
+            if job_data is None:
                  st.error("Nie można pobrać statusu joba. Przerywam.")
                  st.session_state["stop_polling"] = True
                  break
-            
-            job_data = status_resp.json()
+
             status = job_data.get("status")
             notes = job_data.get("notes")
             total_products = job_data.get("total_products", 0)
@@ -132,12 +211,11 @@ if "job_id" in st.session_state and not st.session_state.get("stop_polling", Fal
                 st.session_state["stop_polling"] = True
                 break # Zakończ pętlę
 
-            # Stan 2: Sprawdź produkty
-            products_resp = requests.get(f"{API_BASE}/imports/{job_id}/products")
-            products = products_resp.json() if products_resp.status_code == 200 else []
+            # Stan 2: Sprawdź produkty (tylko wiersze zmienione od ostatniego odczytu)
+            df, changed = _refresh_products(products, job_data)
 
             # Stan 3: W trakcie (jeśli nie ma jeszcze produktów)
-            if not products:
+            if df.empty:
                 if total_products:
                     progress = int((completed_products / total_products) * 100)
                     progress_bar.progress(progress)
@@ -151,14 +229,11 @@ if "job_id" in st.session_state and not st.session_state.get("stop_polling", Fal
                     elif status == "processing":
                         status_text.info("Zadanie uruchomione, oczekiwanie na pierwsze wyniki...")
 
-                time.sleep(3)
-                continue # Sprawdź status ponownie
+                continue # Czekaj na kolejna zmiane statusu
 
             # --- KONIEC POPRAWKI ---
 
             # Stan 4: Przetwarzanie (są produkty)
-            df = pd.DataFrame(products)
-            
             total = len(df)
             done = len(df[df["status"].isin(["done", "not_found", "error"])])
             progress = int((done / total) * 100) if total > 0 else 0
@@ -175,44 +250,41 @@ if "job_id" in st.session_state and not st.session_state.get("stop_polling", Fal
                 f"W kolejce: {queued_products}, w trakcie: {processing_products})"
             )
 
-            def color_recommendation(val):
-                if val == "opłacalny": return "background-color: #b2f0b2"
-                elif val == "nieopłacalny": return "background-color: #f0b2b2"
-                elif val == "brak na Allegro": return "background-color: #f0e1b2"
-                elif val == "błąd pobierania": return "background-color: #f0b2b2"
-                elif val == "w trakcie...": return "background-color: #e0e0e0"
-                else: return ""
-
-            # --- POPRAWKA: Zmiana .applymap na .map ---
-            results_placeholder.dataframe(
-                df.style.map(color_recommendation, subset=["recommendation"])
-            )
-            # --- KONIEC POPRAWKI ---
-
-            
+            # tabela renderowana tylko przy zmianie (i raz po kazdym przeladowaniu skryptu)
+            if changed or not table_shown:
+                summary_placeholder.markdown(_summary(df))
+                results_placeholder.dataframe(
+                    _filter_products(df, selected_rekom, selected_status)
+                    .drop(columns="updated_at", errors="ignore")
+                    .style.apply(recommendation_styles, subset=["recommendation"]),
+                    hide_index=True,
+                )
+                table_shown = True
 
             # Stan 5: Sukces (Zakończono)
             if done == total and total > 0:
                 st.success("Przetwarzanie zakończone!")
                 st.session_state["stop_polling"] = True 
-                
-                csv_buffer = BytesIO()
-                df.to_csv(csv_buffer, index=False, encoding='utf-8')
-                st.download_button(
-                    label="Pobierz gotowy raport CSV",
-                    data=csv_buffer.getvalue(),
-                    file_name=f"raport_job_{job_id}.csv",
-                    mime="text/csv"
+
+                # raport strumieniowany przez backend - bez kopii w pamieci Streamlit
+                st.link_button(
+                    "Pobierz gotowy raport CSV",
+                    url=export_url(job_id, status=selected_status, recommendation=selected_rekom),
                 )
                 break 
 
-            time.sleep(3) 
+    except requests.exceptions.ConnectionError:
+        st.error("Utracono połączenie z backendem. Przerywam monitorowanie.")
+        st.session_state["stop_polling"] = True
+    except Exception as e:
+        st.error(f"Wystąpił błąd frontendu: {e}")
+        st.session_state["stop_polling"] = True
+
 
-        except requests.exceptions.ConnectionError:
-            st.error("Utracono połączenie z backendem. Przerywam monitorowanie.")
-            st.session_state["stop_polling"] = True
-            break
-        except Exception as e:
-            st.error(f"Wystąpił błąd frontendu: {e}")
-            st.session_state["stop_polling"] = True
-            break
+st.set_page_config(page_title="Import Allegro", layout="wide")
+st.title("Pilot: Import i analiza produktów")
+
+render_sidebar()
+render_upload()
+if "job_id" in st.session_state and not st.session_state.get("stop_polling", False):
+    render_monitor(st.session_state["job_id"])
@@ -0,0 +1,14 @@
+# Plik: frontend/styles.py
+
+# Kolor tla wg rekomendacji (brak wpisu = bez koloru)
+RECOMMENDATION_STYLES = {
+    "opłacalny": "background-color: #b2f0b2",
+    "nieopłacalny": "background-color: #f0b2b2",
+    "brak na Allegro": "background-color: #f0e1b2",
+    "błąd pobierania": "background-color: #f0b2b2",
+    "w trakcie...": "background-color: #e0e0e0",
+}
+
+def recommendation_styles(col):
+    # cala kolumna jednym Series.map zamiast wywolania funkcji na kazda komorke
+    return col.map(RECOMMENDATION_STYLES).fillna("")